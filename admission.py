@@ -0,0 +1,112 @@
+import time
+import threading
+
+# Admission control for the Web app so a spike of requests doesn't start more model fan outs than can be served.
+# At most max_in_flight requests run at once, up to max_waiting more wait (for at most max_wait_seconds) and
+# the rest are turned away at once (the app answers 429 with a Retry-After header).
+# Waiting requests are let in by the priority of their action (cheaper actions first), then the client with the
+# fewest requests running (fairness) and then in order of arrival. A client can be limited to per_client_max requests
+# running at once. When the wait queue is full a new request displaces the last waiting one if it has a better priority.
+# Uses threading primitives as Flask serves each request in its own thread (and event loop).
+
+class Waiter:
+  def __init__(self, client, priority, seq):
+    self.client = client
+    self.priority = priority
+    self.seq = seq
+    self.admitted = False
+    self.shed = False
+
+class Admission:
+
+  def __init__(self, max_in_flight=8, max_waiting=16, max_wait_seconds=10, per_client_max=None,
+               priorities=None, default_priority=1):
+    self.max_in_flight = max_in_flight
+    self.max_waiting = max_waiting
+    self.max_wait_seconds = max_wait_seconds
+    self.per_client_max = per_client_max
+    self.priorities = priorities or {}
+    self.default_priority = default_priority
+    self.condition = threading.Condition()
+    self.in_flight = 0
+    self.client_in_flight = {}
+    self.waiting = []
+    self.seq = 0
+    self.counts = { "admitted": 0, "rejected": 0, "timed_out": 0, "shed": 0 }
+    self.max_waiting_seen = 0
+
+  def priority(self, action):
+    return self.priorities.get(action, self.default_priority)
+
+  def order(self, waiter):
+    return (waiter.priority, self.client_in_flight.get(waiter.client, 0), waiter.seq)
+
+  def can_run(self, client):
+    return self.per_client_max is None or self.client_in_flight.get(client, 0) < self.per_client_max
+
+  def start(self, client):
+    self.in_flight += 1
+    self.client_in_flight[client] = self.client_in_flight.get(client, 0) + 1
+    self.counts["admitted"] += 1
+
+  def grant(self):
+    """Let in the best waiting requests while there is room"""
+    while self.in_flight < self.max_in_flight:
+      eligible = [waiter for waiter in self.waiting if self.can_run(waiter.client)]
+      if len(eligible) == 0:
+        return
+      waiter = min(eligible, key=self.order)
+      self.waiting.remove(waiter)
+      waiter.admitted = True
+      self.start(waiter.client)
+      self.condition.notify_all()
+
+  def acquire(self, client, action):
+    """Wait for a request to be let in. False if it was turned away (then don't call release)."""
+    with self.condition:
+      priority = self.priority(action)
+      if len(self.waiting) == 0 and self.in_flight < self.max_in_flight and self.can_run(client):
+        self.start(client)
+        return True
+
+      if len(self.waiting) >= self.max_waiting:
+        worst = max(self.waiting, key=self.order) if len(self.waiting) > 0 else None
+        if worst is None or worst.priority <= priority:
+          self.counts["rejected"] += 1
+          return False
+        self.waiting.remove(worst)
+        worst.shed = True
+        self.counts["shed"] += 1
+        self.condition.notify_all()
+
+      self.seq += 1
+      waiter = Waiter(client, priority, self.seq)
+      self.waiting.append(waiter)
+      self.max_waiting_seen = max(self.max_waiting_seen, len(self.waiting))
+      self.grant()
+      deadline = time.time() + self.max_wait_seconds
+      while not waiter.admitted and not waiter.shed:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          self.waiting.remove(waiter)
+          self.counts["timed_out"] += 1
+          return False
+        self.condition.wait(remaining)
+      return waiter.admitted
+
+  def release(self, client):
+    with self.condition:
+      self.in_flight -= 1
+      self.client_in_flight[client] -= 1
+      if self.client_in_flight[client] == 0:
+        del self.client_in_flight[client]
+      self.grant()
+
+  def gauges(self):
+    with self.condition:
+      waiting_by_priority = {}
+      for waiter in self.waiting:
+        waiting_by_priority[waiter.priority] = waiting_by_priority.get(waiter.priority, 0) + 1
+      return dict(self.counts, in_flight=self.in_flight, waiting=len(self.waiting), max_waiting_seen=self.max_waiting_seen,
+                  waiting_by_priority=waiting_by_priority, clients_in_flight=len(self.client_in_flight),
+                  max_in_flight=self.max_in_flight, max_waiting=self.max_waiting)
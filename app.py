@@ -1,16 +1,67 @@
 # partly generated by Gemini AI
 from flask import Flask, request, render_template, jsonify
 
-from multillm import run_comparison
+from multillm import run_comparison_with_usage, close_connections
 from config import configure, web_comparisons, default_web_comparison, set_trail_only
 from config import models, comparison_models, get_diff_comparator, set_diff_comparator
 import config
+import math
+from jobqueue import JobQueue
+from admission import Admission
+import keypool
 
 configure()
 dev = True
 
 app = Flask(__name__)
 
+admission = None
+if config.max_in_flight_requests is not None:
+    admission = Admission(config.max_in_flight_requests, config.max_waiting_requests, config.max_wait_seconds,
+                          config.per_client_max_in_flight, config.action_priorities, 2)
+
+
+def client_id():
+    return request.headers.get(config.client_id_header) or request.remote_addr or "unknown"
+
+
+def too_busy():
+    return {"Retry-After": str(config.retry_after_seconds)}
+
+
+def parse_budget(data):
+    """The budget (dollars) of a request or None, raising ValueError if it isn't a number of at least 0"""
+    budget = data.get("budget")
+    if budget is None:
+        return None
+    if isinstance(budget, bool):
+        raise ValueError("Invalid request: 'budget' must be a number.")
+    try:
+        budget = float(budget)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid request: 'budget' must be a number.")
+    if not math.isfinite(budget) or budget < 0:
+        raise ValueError("Invalid request: 'budget' must be a finite number of at least 0.")
+    return budget
+
+
+async def admitted_comparison(prompt, action, budget=None):
+    """Run a comparison once admitted. None if turned away.
+       Each request runs on its own event loop so the connections opened on it are closed when it is done."""
+    try:
+        if admission is None:
+            return await run_comparison_with_usage(prompt, action, budget)
+        client = client_id()
+        # blocks only this request's thread (and event loop) while waiting
+        if not admission.acquire(client, action):
+            return None
+        try:
+            return await run_comparison_with_usage(prompt, action, budget)
+        finally:
+            admission.release(client)
+    finally:
+        await close_connections()
+
 
 @app.route('/prompt', methods=['POST'])
 async def prompt():
@@ -19,17 +70,74 @@ async def prompt():
         if not data or 'prompt' not in data:
             return jsonify({"error": "Invalid request: 'prompt' field is required."}), 400
         
+        try:
+            budget = parse_budget(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         prompt = data['prompt']
         action = data.get("action", "3-way")
-        trail = await run_comparison(prompt, action)
+        result = await admitted_comparison(prompt, action, budget)
+        if result is None:
+            return jsonify({"error": "Too many requests, try again later."}), 429, too_busy()
+        trail, usage = result
 
         response_text = trail[-1]
-        response = {"compared_response": response_text}
+        response = {"compared_response": response_text, "usage": usage}
         return jsonify(response), 200
 
     except Exception as e:
       return jsonify({"error": f"Error processing the prompt: {str(e)}"}), 500
 
+
+@app.route('/jobs', methods=['POST'])
+def enqueue_job():
+    data = request.get_json()
+    if not data or 'prompt' not in data:
+        return jsonify({"error": "Invalid request: 'prompt' field is required."}), 400
+
+    try:
+        budget = parse_budget(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    snapshot = config.snapshot()
+    if budget is not None:
+        snapshot["max_cost_per_request"] = budget
+    id = get_job_queue().enqueue(data['prompt'], data.get("action", "3-way"), snapshot)
+    return jsonify({"id": id}), 202
+
+
+@app.route('/jobs/<id>', methods=['GET'])
+def job_result(id):
+    job = get_job_queue().get(id)
+    if job is None:
+        return jsonify({"error": "No such job."}), 404
+    response = {"id": id, "state": job["state"]}
+    if job["state"] == "done":
+        response["compared_response"] = job["result"]["compared_response"]
+        response["usage"] = job["result"].get("usage")
+    if job["error"] is not None:
+        response["error"] = job["error"]
+    return jsonify(response), 200
+
+
+@app.route('/admission', methods=['GET'])
+def admission_gauges():
+    if admission is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(admission.gauges()), 200
+
+
+@app.route('/keys', methods=['GET'])
+def key_usage():
+    """Requests, errors, rate limiting and tokens per api key (keys shown by their last 4 characters)"""
+    return jsonify(keypool.report()), 200
+
+
+def get_job_queue():
+    return JobQueue(config.job_queue_file, config.job_visibility_timeout_seconds, config.job_max_attempts)
+
       
 @app.route("/", methods=["GET", "POST"])
 async def index():
@@ -42,6 +150,9 @@ async def index():
           return render_template("index.html", selected_comp=selected_comp, comps=web_comparisons)
         
         response_lines = await process_prompt(input_text, selected_comp)
+        if response_lines is None:
+            response_lines = ["Too many requests, try again in " + str(config.retry_after_seconds) + " seconds."]
+            return render_template("index.html", response=response_lines, prompt=input_text, selected_comp=selected_comp, comps=web_comparisons), 429, too_busy()
 
         return render_template("index.html", response=response_lines, prompt=input_text, selected_comp=selected_comp, comps=web_comparisons) # Render the HTML page
     
@@ -154,8 +265,8 @@ async def process_prompt(prompt, selected_comp):
     i = int(selected_comp)
     comp = web_comparisons[i]
    
-    result = await run_comparison(prompt, comp) # respond with a list of strings
-    return result
+    result = await admitted_comparison(prompt, comp) # respond with a list of strings (None if turned away)
+    return None if result is None else result[0]
   except Exception as e:
      return ["failed to run comparison", str(e)]
 
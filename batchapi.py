@@ -0,0 +1,215 @@
+# Offline bulk runs of a prompt set through the vendor batch APIs (OpenAI Batch API and Anthropic Message Batches),
+# cheaper and not subject to the real time rate limits.
+# The comparison strategies in multillm.py run unchanged in rounds: each run goes as far as it can with the responses
+# already made and the queries it needs next are collected (see multillm.precomputed). The queries of all the runs
+# are then sent as one batch job per vendor (models without a batch API are asked directly), the jobs are polled
+# until they end and the runs go again with the new responses until every run is done.
+#
+#   python3 batchapi.py 3-way prompts-file --output results.jsonl
+import sys
+import json
+import time
+import asyncio
+import argparse
+import aiohttp
+
+import config
+from config import configure, set_trail_only
+import multillm
+import support
+from worker import read_prompts
+import openai
+import claud
+
+class Round:
+  """The responses made so far and the queries pending for the next batch"""
+  def __init__(self):
+    self.responses = {} # (model name, query) -> response
+    self.pending = {}   # (model name, query) -> model
+
+def error(message):
+  return json.dumps({ "error": message })
+
+async def poll(session, url, headers, is_done):
+  """Get a batch until is_done says it has ended"""
+  deadline = time.time() + config.batch_timeout_seconds
+  while True:
+    async with session.get(support.rewrite_url(url), headers=headers) as response:
+      batch = await response.json()
+    if response.status != 200:
+      raise RuntimeError(f"Failed to get batch {url}: {response.status} {batch}")
+    if is_done(batch):
+      return batch
+    if time.time() > deadline:
+      raise RuntimeError(f"Batch {url} didn't end in {config.batch_timeout_seconds} seconds")
+    await asyncio.sleep(config.batch_poll_seconds)
+
+async def run_openai_batch(session, queries):
+  """Send queries (custom id -> query) as an OpenAI batch returning custom id -> response"""
+  headers = { "Authorization": "Bearer " + openai.openai_api_key }
+  lines = [json.dumps({ "custom_id": id, "method": "POST", "url": "/v1/chat/completions", "body": json.loads(query) })
+           for id, query in queries.items()]
+  form = aiohttp.FormData()
+  form.add_field("purpose", "batch")
+  form.add_field("file", "\n".join(lines).encode(), filename="batch.jsonl", content_type="application/jsonl")
+  async with session.post(support.rewrite_url("https://api.openai.com/v1/files"), data=form, headers=headers) as response:
+    file = await response.json()
+    if response.status != 200:
+      raise RuntimeError(f"Failed to upload OpenAI batch file: {response.status} {file}")
+
+  request = { "input_file_id": file["id"], "endpoint": "/v1/chat/completions", "completion_window": "24h" }
+  async with session.post(support.rewrite_url("https://api.openai.com/v1/batches"), json=request, headers=headers) as response:
+    batch = await response.json()
+    if response.status != 200:
+      raise RuntimeError(f"Failed to create OpenAI batch: {response.status} {batch}")
+  print(f"OpenAI batch {batch['id']} of {len(queries)} requests")
+
+  batch = await poll(session, "https://api.openai.com/v1/batches/" + batch["id"], headers,
+                     lambda b: b["status"] in ["completed", "failed", "expired", "cancelled"])
+  responses = {}
+  for file_id in [batch.get("output_file_id"), batch.get("error_file_id")]:
+    if file_id is None:
+      continue
+    async with session.get(support.rewrite_url("https://api.openai.com/v1/files/" + file_id + "/content"), headers=headers) as response:
+      content = await response.text()
+    for line in content.splitlines():
+      if line.strip() == "":
+        continue
+      result = json.loads(line)
+      body = (result.get("response") or {}).get("body")
+      if body is not None and result["response"].get("status_code") == 200:
+        responses[result["custom_id"]] = json.dumps(body)
+      else:
+        responses[result["custom_id"]] = error(result.get("error") or body)
+  return responses
+
+async def run_anthropic_batch(session, queries):
+  """Send queries (custom id -> query) as an Anthropic message batch returning custom id -> response"""
+  headers = { "x-api-key": claud.claud_api_key, "anthropic-version": "2023-06-01" }
+  request = { "requests": [{ "custom_id": id, "params": json.loads(query) } for id, query in queries.items()] }
+  async with session.post(support.rewrite_url("https://api.anthropic.com/v1/messages/batches"), json=request, headers=headers) as response:
+    batch = await response.json()
+    if response.status != 200:
+      raise RuntimeError(f"Failed to create Anthropic message batch: {response.status} {batch}")
+  print(f"Anthropic message batch {batch['id']} of {len(queries)} requests")
+
+  batch = await poll(session, "https://api.anthropic.com/v1/messages/batches/" + batch["id"], headers,
+                     lambda b: b["processing_status"] == "ended")
+  responses = {}
+  async with session.get(support.rewrite_url(batch["results_url"]), headers=headers) as response:
+    content = await response.text()
+  for line in content.splitlines():
+    if line.strip() == "":
+      continue
+    result = json.loads(line)
+    if result["result"]["type"] == "succeeded":
+      responses[result["custom_id"]] = json.dumps(result["result"]["message"])
+    else:
+      responses[result["custom_id"]] = error(result["result"].get("error") or result["result"]["type"])
+  return responses
+
+batch_apis = {
+  "openai": run_openai_batch,
+  "anthropic": run_anthropic_batch
+}
+
+async def ask_directly(session, queries, models):
+  """Ask models without a batch API in real time"""
+  ids = list(queries.keys())
+  responses = await asyncio.gather(*[models[id].ask(session, queries[id]) for id in ids])
+  return dict(zip(ids, responses))
+
+async def run_round(pending):
+  """Make the pending queries ((model name, query) -> model) returning (model name, query) -> response"""
+  keys = list(pending.keys())
+  groups = {} # batch api (None to ask directly) -> custom id -> query
+  models = {}
+  for i in range(len(keys)):
+    model = pending[keys[i]]
+    id = "q" + str(i)
+    groups.setdefault(model.batch_api, {})[id] = keys[i][1]
+    models[id] = model
+
+  promises = []
+  # no time limit on the batch jobs (polled until they end) but the direct calls time out as in real time runs
+  async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session, \
+             multillm.getSession() as direct_session:
+    for api, queries in groups.items():
+      if api is None:
+        promises.append(ask_directly(direct_session, queries, models))
+      else:
+        promises.append(batch_apis[api](session, queries))
+    results = await asyncio.gather(*promises)
+
+  responses = {}
+  for result in results:
+    responses.update(result)
+  return { keys[i]: responses.get("q" + str(i), error("missing from batch")) for i in range(len(keys)) }
+
+async def run_batch(prompts, action):
+  """Run the comparison action for every prompt returning a result (prompt, compared response, trail and usage)
+     per prompt in order. Prompts whose runs don't finish get a result with an error instead."""
+  multillm.adaptive_selection = False # the models have to be asked in the same order every round
+  results = [None] * len(prompts)
+  batch = Round()
+  token = multillm.precomputed.set(batch)
+  try:
+    for r in range(config.batch_max_rounds + 1):
+      for i in range(len(prompts)):
+        if results[i] is not None:
+          continue
+        try:
+          trail, usage = await multillm.run_comparison_with_usage(prompts[i], action)
+        except multillm.PendingCall:
+          continue
+        results[i] = { "prompt": prompts[i], "action": action, "compared_response": trail[-1],
+                       "trail": trail, "usage": usage }
+
+      if len(batch.pending) == 0:
+        break
+      if r == config.batch_max_rounds:
+        unfinished(results, prompts, action, f"run not done after {config.batch_max_rounds} rounds")
+        break
+      print(f"Round {r + 1}: {len(batch.pending)} queries for {len([x for x in results if x is None])} runs")
+      try:
+        batch.responses.update(await run_round(batch.pending))
+      except Exception as e:
+        # keep the runs already done (their batch calls are paid for)
+        unfinished(results, prompts, action, f"batch round {r + 1} failed: {e.__class__.__name__}: {e}")
+        break
+      batch.pending = {}
+  finally:
+    multillm.precomputed.reset(token)
+  return results
+
+def unfinished(results, prompts, action, message):
+  """Error results for the prompts without one"""
+  for i in range(len(prompts)):
+    if results[i] is None:
+      results[i] = { "prompt": prompts[i], "action": action, "error": message }
+
+def main():
+  parser = argparse.ArgumentParser(description="Run a comparison action for a prompt set through the vendor batch APIs")
+  parser.add_argument("action", help="3-way|2-way|1-way|none|2-1|3-all|n-way|quorum-k")
+  parser.add_argument("prompts", nargs="?", default=None, help="prompts file (separated by blank lines), default input")
+  parser.add_argument("--output", default=None, help="JSON lines file for the results (default stdout)")
+  args = parser.parse_args()
+
+  set_trail_only(True)
+  configure()
+  if args.prompts is None:
+    prompts = read_prompts(sys.stdin)
+  else:
+    with open(args.prompts, "r") as file:
+      prompts = read_prompts(file)
+
+  results = asyncio.run(run_batch(prompts, args.action))
+  out = sys.stdout if args.output is None else open(args.output, "w")
+  try:
+    for result in results:
+      out.write(json.dumps(result) + "\n")
+  finally:
+    if out is not sys.stdout: out.close()
+
+if __name__ == "__main__":
+  main()
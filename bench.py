@@ -0,0 +1,175 @@
+# Benchmark the overhead of the comparison actions in multillm.py using in-process fake models.
+# The fake models answer and compare after a controlled latency so the numbers reflect multillm itself:
+# wall time, comparator calls, tokens and cost, Python CPU time and peak memory (tracemalloc) per run_comparison.
+# Results are written as JSON lines so they can be kept and diffed to track regressions.
+#
+# Needs the api key files to exist (config.py checks for them) but makes no network calls:
+#   python3 bench.py --models 3,8,16 --sizes short,long --output bench.jsonl
+import sys
+import re
+import json
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+import config
+import multillm
+import support
+
+actions = ["none", "1-way", "2-way", "3-way", "2-1", "3-all", "n-way", "quorum-3"]
+
+answer_sizes = {
+  "short": 20,
+  "medium": 1000,
+  "long": 10000,
+  "very-long": 100000
+}
+
+# Which answer group model i of n gives. Models in the same group agree with each other.
+patterns = {
+  "consensus": lambda i, n: 0,
+  "majority": lambda i, n: 0 if i < n // 2 + 1 else i,
+  "late": lambda i, n: 0 if i >= n // 2 else i + 1,
+  "split": lambda i, n: i
+}
+
+answer_tag = re.compile(r"ANSWER-(\d+)")
+batch_answer = re.compile(r"^(.+) answered:\nANSWER-(\d+)", re.MULTILINE)
+batch_pair = re.compile(r"^Pair (\d+): (.+) and (.+)$", re.MULTILINE)
+
+class Counters:
+  queries = 0
+  comparisons = 0
+  condensings = 0
+
+def respond(query, content):
+  """An OpenAI style response with the usage (about 4 characters a token) the real APIs report"""
+  usage = { "prompt_tokens": len(query) // 4, "completion_tokens": len(content) // 4 }
+  return support.serialize({ "choices": [{ "message": { "content": content } }], "usage": usage })
+
+def make_fake_model(i, n, size, pattern, latency):
+  group = patterns[pattern](i, n)
+  answer = "ANSWER-" + str(group) + " " + "x" * max(0, answer_sizes[size] - 10)
+
+  class Fake(support.Model):
+    name = "fake" + str(i)
+    model = "fake-" + str(i)
+    text_field = "content"
+
+    def make_query(text):
+      return support.make_openai_std_query(text, Fake.model)
+
+    def make_verdict_query(text):
+      return support.make_openai_verdict_query(text, Fake.model)
+
+    async def ask(session, query):
+      await asyncio.sleep(latency)
+      if query.find("State only the final answer") != -1:
+        Counters.condensings += 1
+        return respond(query, answer_tag.search(query).group(0))
+      if query.find("Compare each pair") != -1:
+        Counters.comparisons += 1
+        text = json.loads(query)["messages"][0]["content"].replace("\\n", "\n")
+        groups = dict(batch_answer.findall(text))
+        verdicts = []
+        for p, label1, label2 in batch_pair.findall(text):
+          verdicts.append({ "pair": int(p), "agree": groups[label1] == groups[label2] })
+        return respond(query, json.dumps(verdicts))
+      if query.find("Compare their two") != -1:
+        Counters.comparisons += 1
+        tags = answer_tag.findall(query)
+        verdict = "YES" if len(tags) >= 2 and tags[0] == tags[1] else "NO"
+        return respond(query, verdict)
+      Counters.queries += 1
+      return respond(query, answer)
+
+  return Fake
+
+def install(fakes, price):
+  """Replace the configured models with the fake ones (in place as multillm shares the lists)"""
+  config.models[:] = fakes
+  config.comparison_models[:] = fakes
+  config.schedule.clear()
+  config.comparison_schedule.clear()
+  for fake in fakes:
+    config.schedule[fake.name] = True
+    config.comparison_schedule[fake.name] = True
+  config.set_diff_comparator(True)
+  for fake in fakes:
+    config.model_prices[fake.model] = price
+  multillm.max_no_models = len(fakes)
+
+async def run_one(action, prompt):
+  Counters.queries = 0
+  Counters.comparisons = 0
+  Counters.condensings = 0
+  tracemalloc.start()
+  cpu_start = time.process_time()
+  wall_start = time.perf_counter()
+  trail, usage = await multillm.run_comparison_with_usage(prompt, action)
+  wall = time.perf_counter() - wall_start
+  cpu = time.process_time() - cpu_start
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return {
+    "wall_seconds": round(wall, 6),
+    "cpu_seconds": round(cpu, 6),
+    "peak_memory_bytes": peak,
+    "query_calls": Counters.queries,
+    "comparator_calls": Counters.comparisons,
+    "condense_calls": Counters.condensings,
+    "input_tokens": usage["total"]["input_tokens"],
+    "output_tokens": usage["total"]["output_tokens"],
+    "cost": usage["total"]["cost"],
+    "result": "NONE" if action == "none" else "PASS" if trail[-2] == "PASS compared response" else "FAIL"
+  }
+
+async def bench(args, out):
+  for n in args.models:
+    for size in args.sizes:
+      fakes = [make_fake_model(i, n, size, args.pattern, args.latency) for i in range(n)]
+      install(fakes, args.price)
+      for action in args.actions:
+        runs = [await run_one(action, "benchmark question") for r in range(args.repeat)]
+        record = {
+          "action": action, "models": n, "answer_size": size, "pattern": args.pattern,
+          "latency": args.latency, "repeat": args.repeat, "condense": args.condense,
+          "batch": args.batch
+        }
+        for key in ["wall_seconds", "cpu_seconds", "peak_memory_bytes", "query_calls", "comparator_calls", "condense_calls",
+                    "input_tokens", "output_tokens", "cost"]:
+          values = sorted(run[key] for run in runs)
+          record[key] = values[len(values) // 2] # median
+        record["result"] = runs[-1]["result"]
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+
+def parse_args(argv):
+  parser = argparse.ArgumentParser(description="Benchmark multillm comparison actions with fake models")
+  parser.add_argument("--actions", default=",".join(actions))
+  parser.add_argument("--models", default="3,4,8,16", help="model counts to run with")
+  parser.add_argument("--sizes", default="short,long,very-long", help=",".join(answer_sizes.keys()))
+  parser.add_argument("--pattern", default="majority", choices=patterns.keys(), help="agreement pattern")
+  parser.add_argument("--latency", type=float, default=0.001, help="fake model latency in seconds")
+  parser.add_argument("--repeat", type=int, default=5)
+  parser.add_argument("--condense", default=None, choices=["local", "model"], help="condense responses before comparing")
+  parser.add_argument("--batch", action="store_true", help="batch the comparisons of each comparator")
+  parser.add_argument("--price", default="2.50,10.00", help="fake model dollars per million input,output tokens")
+  parser.add_argument("--output", default=None, help="JSON lines file (default stdout)")
+  args = parser.parse_args(argv)
+  args.actions = args.actions.split(",")
+  args.models = [int(n) for n in args.models.split(",")]
+  args.sizes = args.sizes.split(",")
+  args.price = tuple(float(p) for p in args.price.split(","))
+  return args
+
+if __name__ == "__main__":
+  args = parse_args(sys.argv[1:])
+  multillm.condense_responses = args.condense
+  multillm.batch_comparisons = args.batch
+  if args.output is None:
+    asyncio.run(bench(args, sys.stdout))
+  else:
+    with open(args.output, "w") as out:
+      asyncio.run(bench(args, out))
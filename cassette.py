@@ -0,0 +1,89 @@
+import gzip
+import json
+import atexit
+import hashlib
+import threading
+
+# Record the model requests made by support.ask with their responses, status and latency to a cassette file
+# (JSON lines, gzipped if the name ends in .gz) and replay them back offline without network access or api keys.
+# Requests are matched on their url (without the query string, which may hold an api key) and body.
+# Repeated requests are replayed in the order they were recorded, the last one being repeated once used up.
+# While recording the file stays open (one gzip stream) and writes from all threads go through a lock.
+# Each entry is flushed so a cassette cut off by a crash still replays up to its last entry.
+
+RECORD = "record"
+REPLAY = "replay"
+
+def open_file(path, mode):
+  if path.endswith(".gz"):
+    return gzip.open(path, mode + "t", encoding="utf-8")
+  return open(path, mode, encoding="utf-8")
+
+def strip_query(url):
+  return url.split("?", 1)[0]
+
+def request_key(url, query):
+  return hashlib.sha256((strip_query(url) + "\n" + query).encode()).hexdigest()
+
+class Cassette:
+
+  def __init__(self, path, mode, speed="recorded"):
+    """mode is record or replay, speed is recorded (replay with the recorded latency) or fast"""
+    self.path = path
+    self.mode = mode
+    self.speed = speed
+    self.entries = {}
+    self.used = {}
+    self.file = None
+    self.lock = threading.Lock()
+    if mode == REPLAY:
+      self.load()
+
+  def load(self):
+    with open_file(self.path, "r") as file:
+      try:
+        for line in file:
+          if line.strip() == "":
+            continue
+          entry = json.loads(line)
+          self.entries.setdefault(entry["key"], []).append(entry)
+      except (EOFError, json.JSONDecodeError):
+        pass # cut off while recording, keep the entries read so far
+
+  def replaying(self):
+    return self.mode == REPLAY
+
+  def recording(self):
+    return self.mode == RECORD
+
+  def record(self, url, query, status, latency, body):
+    entry = { "key": request_key(url, query), "url": strip_query(url), "status": status,
+              "latency": round(latency, 4), "body": body }
+    line = json.dumps(entry, separators=(",", ":")) + "\n"
+    with self.lock:
+      if self.file is None:
+        self.file = open_file(self.path, "a")
+        atexit.register(self.close)
+      self.file.write(line)
+      self.file.flush()
+
+  def close(self):
+    with self.lock:
+      if self.file is not None:
+        self.file.close()
+        self.file = None
+
+  def replay(self, url, query):
+    """The recorded entry (with status, latency and body) for a request or None if it wasn't recorded"""
+    key = request_key(url, query)
+    entries = self.entries.get(key)
+    if entries is None:
+      return None
+    with self.lock:
+      i = self.used.get(key, 0)
+      self.used[key] = i + 1
+    return entries[min(i, len(entries) - 1)]
+
+  def delay(self, entry):
+    """Seconds to wait before replaying an entry"""
+    return entry["latency"] if self.speed == "recorded" else 0
@@ -1,6 +1,8 @@
 import support 
+import keypool
 
-claud_api_key = support.read_file_as_string("claud-api-key").strip()
+claud_keys = keypool.read_pool("claud-api-key")
+claud_api_key = claud_keys.first() # for batch jobs
 
 url = "https://api.anthropic.com/v1/messages"
 
@@ -8,6 +10,8 @@ class Claud(support.Model):
   name = "claud"
   model = "claude-3-5-sonnet-20241022"
   text_field = "text"
+  host = "https://api.anthropic.com"
+  batch_api = "anthropic"
 
   def make_query_str(text):
     return "{ \"model\": \"" + Claud.model + "\", \"max_tokens\": 1024, \"messages\": [{\"role\": \"user\", \"content\": \"" + \
@@ -23,11 +27,27 @@ class Claud(support.Model):
 
     return support.serialize(obj)
 
+  def make_verdict_query(text):
+    obj = { "model": Claud.model, "max_tokens": support.verdict_max_tokens, "temperature": 0 }
+    obj["messages"] = [{ "role": "user", "content": text }]
+    return support.serialize(obj)
+
+  def make_cached_query(prefix, text, verdict=False):
+    """The prefix as a system block marked to be cached (cache reads are billed at a tenth of the input price)"""
+    if verdict:
+      obj = { "model": Claud.model, "max_tokens": support.verdict_max_tokens, "temperature": 0 }
+    else:
+      obj = { "model": Claud.model, "max_tokens": 2048 }
+    obj["system"] = [{ "type": "text", "text": prefix, "cache_control": { "type": "ephemeral" } }]
+    obj["messages"] = [{ "role": "user", "content": text }]
+    return support.serialize(obj)
+
   async def ask(session, query):
-    headers = {
-      "Content-Type": "application/json",
-      "x-api-key": claud_api_key,
-      "anthropic-version": "2023-06-01"
-    }
-    return await support.ask(url, session, query, headers)
+    with claud_keys.lease() as lease:
+      headers = {
+        "Content-Type": "application/json",
+        "x-api-key": lease.key,
+        "anthropic-version": "2023-06-01"
+      }
+      return lease.done(await support.ask(url, session, query, headers))
 
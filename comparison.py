@@ -1,3 +1,8 @@
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
 
 statement_compare_instructions = "\nCompare their two statements and say YES if they are equivalent. Otherwise say NO." + \
                        " Make a functional comparison and ignore phrasing differences." + \
@@ -7,25 +12,187 @@ answer_compare_instructions = "\nCompare their two answers and say YES if they a
                        " Make a functional comparison and ignore phrasing differences." + \
                        " Additional information provided by one answer does not matter unless it contradicts the other answer."
 
+batch_compare_instructions = "\nCompare each pair of answers listed above and decide if the two answers of the pair agree." + \
+                       " Make a functional comparison and ignore phrasing differences." + \
+                       " Additional information provided by one answer does not matter unless it contradicts the other answer." + \
+                       " Reply with only a JSON list with one object per pair in the order given, for example" + \
+                       " [{\"pair\": 1, \"agree\": true}, {\"pair\": 2, \"agree\": false}]"
+
+verdict_instructions = "\nReply with only the single word YES or NO."
+
+condense_instructions = "\nState only the final answer given in the response above in one short sentence. Do not explain."
+
+# Lay comparisons out with the static instructions and the question first (the prefix shared by every comparison
+# of a prompt) followed by the answers to compare, so the vendors' prompt caching can reuse the prefix.
+cacheable_layout = False
+compared_header = "\n\nTo compare:\n\n"
+# Marks the end of the static prefix (removed before sending). Only the question comes before it
+# so it is taken out of the question and answers containing it don't matter.
+cache_break = "\x1f"
+
+def set_cacheable_layout(b):
+   global cacheable_layout
+   cacheable_layout = b
+
+# End pair comparisons asking for just the verdict (see config.verdict_mode)
+verdict_only = False
+
+def set_verdict_only(b):
+   global verdict_only
+   verdict_only = b
+
+def verdict_ending():
+   return verdict_instructions if verdict_only else ""
+
+def split_cached_prefix(comparison):
+   """The static prefix of a comparison in the cacheable layout and the rest ("" and the comparison otherwise)"""
+   if not cacheable_layout:
+      return "", comparison
+   i = comparison.find(cache_break)
+   if i == -1:
+      return "", comparison
+   return comparison[:i], comparison[i + len(cache_break):]
+
+# Condensed forms of long responses (hash of the response text -> short final answer form) made once per response
+# and compared instead of the full responses. The least recently used are dropped (shared by the threads of the Web app).
+condensed_answers = OrderedDict()
+max_condensed_answers = 1000
+condensed_lock = threading.Lock()
+
+def answer_key(answer):
+   return hashlib.sha256(answer.encode()).digest()
+
+final_answer_markers = re.compile(r"(final answer|answer is|answer:|in summary|in conclusion|therefore|so the)", re.IGNORECASE)
+sentence_end = re.compile(r"(?<=[.!?])\s+")
+
+def condense(answer, max_chars=300):
+   """Local extraction of the short final answer form of a response: the first sentence and
+      the sentence giving the final answer (or the last sentence)"""
+   if len(answer) <= max_chars:
+      return answer
+   sentences = [s.strip() for s in sentence_end.split(answer.strip()) if s.strip() != ""]
+   if len(sentences) == 0:
+      return answer[:max_chars]
+   final = sentences[-1]
+   for sentence in reversed(sentences):
+      if final_answer_markers.search(sentence):
+         final = sentence
+         break
+   condensed = sentences[0] if sentences[0] == final else sentences[0] + " " + final
+   return condensed[:max_chars]
+
+def set_condensed(answer, condensed):
+   with condensed_lock:
+      condensed_answers[answer_key(answer)] = condensed
+      condensed_answers.move_to_end(answer_key(answer))
+      while len(condensed_answers) > max_condensed_answers:
+         condensed_answers.popitem(last=False)
+
+def is_condensed(answer):
+   with condensed_lock:
+      return answer_key(answer) in condensed_answers
+
+def comparison_form(answer):
+   """The condensed form of an answer if there is one otherwise the answer itself"""
+   key = answer_key(answer)
+   with condensed_lock:
+      condensed = condensed_answers.get(key)
+      if condensed is None:
+         return answer
+      condensed_answers.move_to_end(key)
+      return condensed
+
+def make_condense_query(answer):
+   return "Response:\n" + answer + "\n" + condense_instructions
+
+def full_stop(str):
+   """The full stop to add to the end of a text (without copying it) if it doesn't end with one"""
+   i = len(str) - 1
+   while i >= 0 and str[i].isspace():
+      i -= 1
+   return "" if i >= 0 and str[i] == "." else "."
+
 def add_full_stop(str):
-   if str.strip().endswith("."):
-      return str
-   else:
-      return str + "."
+   return str + full_stop(str)
+
+def is_blank(str):
+   return str == "" or str.isspace()
+
+# The comparisons are built with a single join so long answers are only copied once.
 
 def make_statement_comparison(query, actor1, statement1, actor2, statement2):
-    if statement1.strip() == "" or statement2.strip() == "":
+    if is_blank(statement1) or is_blank(statement2):
       return ""
-    return "" + actor1 + " says:\n" + add_full_stop(statement1) + "\n\n" + \
-           actor2 + " says:\n" + add_full_stop(statement2) + "\n" + \
-           statement_compare_instructions
+    statement1 = comparison_form(statement1)
+    statement2 = comparison_form(statement2)
+    if cacheable_layout:
+      return "".join(["Two statements follow.", statement_compare_instructions, compared_header, cache_break,
+                      actor1, " says:\n", statement1, full_stop(statement1), "\n\n",
+                      actor2, " says:\n", statement2, full_stop(statement2), verdict_ending()])
+    return "".join([actor1, " says:\n", statement1, full_stop(statement1), "\n\n",
+                    actor2, " says:\n", statement2, full_stop(statement2), "\n",
+                    statement_compare_instructions, verdict_ending()])
 
 def make_answer_comparison(query, actor1, answer1, actor2, answer2):
-    if answer1.strip() == "" or answer2.strip() == "":
+    if is_blank(answer1) or is_blank(answer2):
       return ""
-    return "When " + actor1 + " and " + actor2 + " were asked the following:\n" + add_full_stop(query) + "\n\n" + actor1 + " answered:\n" + add_full_stop(answer1) + "\n\n" + \
-           actor2 + " answered:\n" + add_full_stop(answer2) + "\n" + \
-           answer_compare_instructions
+    answer1 = comparison_form(answer1)
+    answer2 = comparison_form(answer2)
+    if cacheable_layout:
+      query = query.replace(cache_break, "")
+      return "".join(["Two people were asked the question below.", answer_compare_instructions,
+                      "\n\nThe question:\n", query, full_stop(query), compared_header, cache_break,
+                      actor1, " answered:\n", answer1, full_stop(answer1), "\n\n",
+                      actor2, " answered:\n", answer2, full_stop(answer2), verdict_ending()])
+    return "".join(["When ", actor1, " and ", actor2, " were asked the following:\n", query, full_stop(query), "\n\n",
+                    actor1, " answered:\n", answer1, full_stop(answer1), "\n\n",
+                    actor2, " answered:\n", answer2, full_stop(answer2), "\n",
+                    answer_compare_instructions, verdict_ending()])
+
+def make_batch_comparison(query, answers, pairs):
+    """One comparison of several pairs. answers is a list of (actor, answer) and pairs a list of index pairs into it."""
+    listed = []
+    for actor, answer in answers:
+      answer = comparison_form(answer)
+      listed += [actor, " answered:\n", answer, full_stop(answer), "\n\n"]
+    listed.append("Pairs to compare:\n")
+    for p in range(len(pairs)):
+      i, j = pairs[p]
+      listed += ["Pair ", str(p + 1), ": ", answers[i][0], " and ", answers[j][0], "\n"]
+    if cacheable_layout:
+      query = query.replace(cache_break, "")
+      return "".join(["Several people were asked the question below.", batch_compare_instructions.replace("above", "below"),
+                      "\n\nThe question:\n", query, full_stop(query), compared_header, cache_break] + listed)
+    return "".join(["When " + ", ".join([actor for actor, answer in answers]) + " were asked the following:\n",
+                    query, full_stop(query), "\n\n"] + listed + [batch_compare_instructions])
+
+def parse_batch_verdicts(text, count):
+    """The list of agree booleans for count pairs from a batch comparison reply or None if it is not valid"""
+    start = text.find("[")
+    end = text.rfind("]")
+    if start == -1 or end < start:
+      return None
+    try:
+      verdicts = json.loads(text[start:end + 1])
+    except ValueError:
+      return None
+    if not isinstance(verdicts, list) or len(verdicts) != count:
+      return None
+    agreed = [None] * count
+    for p in range(count):
+      verdict = verdicts[p]
+      if isinstance(verdict, bool):
+        agreed[p] = verdict
+        continue
+      if not isinstance(verdict, dict) or not isinstance(verdict.get("agree"), bool):
+        return None
+      pair = verdict.get("pair", p + 1)
+      if not isinstance(pair, int) or pair < 1 or pair > count or agreed[pair - 1] is not None:
+        return None
+      agreed[pair - 1] = verdict["agree"]
+    if None in agreed:
+      return None
+    return agreed
 
 # Configure the type of comparison to make:
 
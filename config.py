@@ -18,17 +18,25 @@ from grok import Grok, Grok2
 from llama import Llama, Llama2
 from hugface import HugFace, HugFace2, HugFace3
 from faulty import Faulty
+from local import Local
+import selector
+import semcache
+import support
+import keypool
+import comparison
+import cassette
+from transport import make_transport
 
 # new model? add here
 # The models and order of responses (skiping any not in schedule). Need at least 3 different models for 3 way comparisons.
 # Order by preference for answers.
-models = [Gemini, Gemini2, Claud, Openai, Openai2, Grok, Grok2, Llama, Llama2, HugFace, HugFace2, HugFace3, Faulty]
+models = [Gemini, Gemini2, Claud, Openai, Openai2, Grok, Grok2, Llama, Llama2, HugFace, HugFace2, HugFace3, Local, Faulty]
 
 # new model? add here if to be used for comparisons
 # The models that can be used for comparisons (skipping any not in comparison schedule). 
 # Order by prefence for comparisons. Need at least 3 models for 3-way comparisons. 
 # Can add a model more than once but that can't be configured via the Web UI.
-comparison_models = [Openai, Gemini, Claud, Grok2, Llama, Faulty]
+comparison_models = [Openai, Gemini, Claud, Grok2, Llama, Local, Faulty]
 
 # use another model for comparison than those used for queries if true
 # use models from the comparion list in order if false.
@@ -43,6 +51,9 @@ def set_diff_comparator(value):
 
 max_no_models = 5
 
+# quorum-k comparisons start with k models and bring in this many more at a time until k agree
+quorum_batch_size = 1
+
 T = True
 F = False
 
@@ -61,6 +72,7 @@ schedule = {
   "hugface": F,
   "hugface2": F,
   "hugface3": F,
+  "local": F,
   "faulty": F
 }
 
@@ -73,6 +85,7 @@ comparison_schedule = {
   "grok2": F,
   "llama": F,
   "hugface": F,
+  "local": F,
   "faulty": F
 }
 
@@ -90,13 +103,109 @@ model_versions = {
   "llama2": "llama3.3-70b",
   "hugface": "google/gemma-2-2b-it",
   "hugface2": "microsoft/Phi-3-mini-4k-instruct",
-  "hugface3": "Qwen/Qwen2.5-7B-Instruct"
+  "hugface3": "Qwen/Qwen2.5-7B-Instruct",
+  "local": "llama3.2:3b"
+}
+
+# new model? add the price of its model version here to include it in the cost accounting
+# dollars per million (input tokens, output tokens) by model version. Models without a price count tokens only.
+# and optionally the price of cached input tokens (see prompt_caching)
+model_prices = {
+  "gemini-1.5-flash-latest": (0.075, 0.30, 0.01875),
+  "gemini-2.0-flash-exp": (0.10, 0.40, 0.025),
+  "claude-3-5-sonnet-20241022": (3.00, 15.00, 0.30),
+  "gpt-4o": (2.50, 10.00, 1.25),
+  "chatgpt-4o-latest": (5.00, 15.00),
+  "grok-beta": (5.00, 15.00),
+  "grok-2-latest": (2.00, 10.00),
+  "llama3.2:3b": (0.0, 0.0) # local
 }
 
+# Stop bringing in further models (2-1 and quorum-k) or making further comparisons once the calls made for a prompt
+# have cost this many dollars. None for no budget.
+max_cost_per_request = None
+show_usage = False # add the tokens and cost of the calls made per phase to the trail (multillm.py --usage)
+
+
+# Order the scheduled models and comparison models by their recorded latency, errors and wins
+# instead of by the static order above (which remains the fallback for unmeasured models).
+adaptive_selection = False
+selection_stats_file = "model-stats.json"
+selection_exploration = 0.1 # chance of using the static order for a run
+selection_save_seconds = 10 # how often the stats are merged into the stats file
+
+# Compare a short final answer form of long responses instead of the full responses (made once per response):
+# None to compare full responses, "local" to extract it locally or "model" to ask the first comparison model.
+condense_responses = None
+condense_min_chars = 300 # responses up to this long are compared as they are
+
+# Send all the pairs a comparator has to compare in n-way and 3-all comparisons in one request
+# (asking for a JSON list of verdicts) instead of one request per pair.
+batch_comparisons = False
+
+# Start the later comparisons of 2-way and 3-way comparisons before the earlier ones have answered: None to compare
+# one after another, 0 to start them all at once or the seconds to wait before starting each next one (it starts at once
+# if the one before it disagrees). The verdicts are still taken in order so the result is the same as comparing one
+# after another and comparisons no longer needed are cancelled (the vendor may still bill the tokens of those cut off).
+speculative_comparisons = None
+
+# How comparators are picked when they have to differ from the models compared: None for the first eligible one in
+# order of preference, "round-robin" to spread the pairs of a run evenly over the eligible comparators or
+# "least-outstanding" for the one with the fewest requests in flight (counting those of other runs in the process)
+# so the comparisons of n-way and 3-all runs go out in parallel to several vendors instead of queueing behind one.
+comparator_balancing = None
+
+# multillm.py pipe mode: prompts (one per line) run at once up to this many at a time and their results are
+# written in input order (or as they finish if not ordered)
+pipe_max_in_flight = 8
+pipe_ordered = True
+
+# Ask comparators for just a YES or NO (tiny output budget, temperature 0, constrained where the API allows)
+# instead of a verdict followed by an explanation.
+verdict_mode = False
+
+# Lay comparison queries out with the static instructions and the question first and mark that prefix to be cached
+# by the APIs that need it (Anthropic cache control, Gemini cached contents for prefixes of at least
+# gemini_cache_min_tokens). OpenAI and Grok cache long prefixes automatically.
+prompt_caching = False
+gemini_cache_min_tokens = 32768 # the API minimum for cached contents (None to not use cached contents)
+gemini_cache_ttl_seconds = 300
+
+# Answer near repeats of earlier prompts (for the same comparison action) from a local similarity index.
+semantic_cache = False
+semantic_cache_threshold = 0.9 # estimated Jaccard similarity of the normalised prompts needed for a hit
+semantic_cache_ttl_seconds = 3600
+semantic_cache_max_entries = 10000
+
+# The local OpenAI compatible inference server (llama.cpp server, Ollama ...) used by the local model.
+# Ollama serves the OpenAI API on http://127.0.0.1:11434. Set local_unix_socket to connect over a Unix socket
+# (with the aiohttp transport) and local_max_concurrency to the requests the server can serve at once.
+local_url = "http://127.0.0.1:8080"
+local_unix_socket = None
+local_max_concurrency = 2
+
+# Seconds a key is taken out of its provider's pool after a 429 (or 401, 402, 403) without a Retry-After header
+# or when it has no requests left. Key files can hold several keys, one per line (see keypool.py).
+key_cooldown_seconds = 30
+
+# Point every model at a local stand-in server (see standin.py) e.g. "http://127.0.0.1:8089" for offline testing.
+# None to use the vendor APIs.
+standin_url = None
 
 web_comparisons = ["1-way", "3-way", "n-way", "none" ]
 default_web_comparison = web_comparisons.index("3-way")
 
+# Admission control of the Web app prompts (see admission.py): requests running at once (None for no limit),
+# requests waiting and how long they wait before being turned away with a 429.
+max_in_flight_requests = 8
+max_waiting_requests = 16
+max_wait_seconds = 10
+retry_after_seconds = 5
+per_client_max_in_flight = None # None for no per client limit
+client_id_header = "X-Client-Id" # identifies the client (the remote address if not sent)
+# Waiting requests are let in by the priority of their action (lowest first). Other actions have priority 2.
+action_priorities = { "none": 0, "1-way": 0, "2-way": 1, "2-1": 1, "3-way": 1, "3-all": 2, "n-way": 3 }
+
 # new model? add here if you want the model version to be configrable
 def configure():
   # Push down the model configuration to imported models to reflect any changes above.
@@ -112,9 +221,107 @@ def configure():
   HugFace.model = model_versions["hugface"]
   HugFace2.model = model_versions["hugface2"]
   HugFace3.model = model_versions["hugface3"]
+  Local.model = model_versions["local"]
+  Local.host = local_url
+  Local.unix_socket = local_unix_socket
+  Local.max_concurrency = local_max_concurrency
+
+  Gemini.cache_min_tokens = gemini_cache_min_tokens
+  Gemini.cache_ttl_seconds = gemini_cache_ttl_seconds
+  comparison.set_cacheable_layout(prompt_caching)
+  comparison.set_verdict_only(verdict_mode)
+
+  selector.configure(selection_stats_file, selection_exploration, selection_save_seconds)
+  semcache.configure(semantic_cache_threshold, semantic_cache_ttl_seconds, semantic_cache_max_entries)
+  support.set_url_override(standin_url)
+  keypool.configure(key_cooldown_seconds)
+  support.set_max_response_bytes(max_response_bytes)
+  configure_transport()
+  configure_cassette()
+
+def configure_transport():
+  if support.http_transport.name != transport:
+    support.set_transport(make_transport(transport, client_timeout_seconds), gzip_request_min_bytes)
+  else:
+    support.set_transport(support.http_transport, gzip_request_min_bytes)
+
+def configure_cassette():
+  c = support.cassette
+  if cassette_mode is None:
+    support.set_cassette(None)
+  elif c is None or (c.path, c.mode, c.speed) != (cassette_file, cassette_mode, cassette_speed):
+    support.set_cassette(cassette.Cassette(cassette_file, cassette_mode, cassette_speed))
+
+def snapshot():
+  """The configuration (as changed by the Web UI) to run a queued job with"""
+  return {
+    "schedule": dict(schedule),
+    "comparison_schedule": dict(comparison_schedule),
+    "diff_comparator": diff_comparator,
+    "model_versions": dict(model_versions),
+    "max_cost_per_request": max_cost_per_request
+  }
+
+def get_max_cost_per_request():
+  return max_cost_per_request
+
+def set_max_cost_per_request(value):
+  global max_cost_per_request
+  max_cost_per_request = value
+
+def restore(snapshot):
+  schedule.update(snapshot["schedule"])
+  comparison_schedule.update(snapshot["comparison_schedule"])
+  set_diff_comparator(snapshot["diff_comparator"])
+  model_versions.update(snapshot["model_versions"])
+  set_max_cost_per_request(snapshot.get("max_cost_per_request"))
+  configure()
 
 client_timeout_seconds = 30
 
+# Keep every run with its calls (latency, status, tokens, verdicts) in a local store for python3 runstore.py report
+record_runs = False
+run_store_file = "runs.db"
+
+# Offline bulk runs through the vendor batch APIs (see batchapi.py)
+batch_poll_seconds = 30
+batch_timeout_seconds = 24 * 3600 # the longest completion window of the batch APIs
+batch_max_rounds = 10 # rounds of batched calls a run may take (each dependent step is a round, 3-way takes up to 4)
+batch_price_factor = 0.5 # batch API calls are billed at this fraction of the real time price
+
+# Local durable job queue (see worker.py) used by worker processes, the batch CLI and the Web app /jobs endpoint
+job_queue_file = "jobs.db"
+job_visibility_timeout_seconds = 120 # a job not completed or extended in this time is delivered again
+job_max_attempts = 3
+
+# Limits on the size of responses so the memory used per prompt stays predictable.
+# Response bodies are read incrementally and dropped if larger than the byte limit,
+# response texts longer than the character limit are truncated (both noted in the trail).
+max_response_bytes = 4 * 1024 * 1024
+max_response_chars = 100000
+response_byte_limits = {} # model name -> bytes, to override max_response_bytes
+response_char_limits = {} # model name -> characters, to override max_response_chars
+
+# Record model requests and responses to a cassette file or replay them from it (no network or api keys needed)
+# None, "record" or "replay". Replay at the "recorded" speed or as "fast" as possible.
+cassette_mode = None
+cassette_file = "cassette.jsonl.gz"
+cassette_speed = "recorded"
+
+# HTTP transport for model requests: "aiohttp" (HTTP/1.1) or "httpx" for HTTP/2 with requests to the same host
+# multiplexed over one connection (needs pip install 'httpx[http2]').
+transport = "aiohttp"
+gzip_request_min_bytes = None # gzip request bodies at least this long (not every API accepts compressed requests)
+show_calls = False # add the calls made with their timing and transport statistics to the trail (multillm.py --calls)
+
+# Open pooled connections (DNS and TLS set up) to the hosts of the scheduled models and comparators at start up
+# and keep them warm in long running processes so the first prompt isn't slower than the rest.
+warm_up = False
+warm_up_connections_per_host = 2
+warm_up_interval_seconds = 45 # below keepalive_seconds so pooled connections don't expire
+keepalive_seconds = 60
+dns_cache_seconds = 300
+
 debug = False
 trail_only = True
 
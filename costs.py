@@ -0,0 +1,67 @@
+# Token and cost accounting of model calls.
+# The usage reported in each response (OpenAI style usage, Anthropic usage or Gemini usageMetadata) is recorded
+# on the call (see multillm.ask_model) and priced with a table of dollars per million input and output tokens
+# keyed by model version. Calls to models without a price count tokens only.
+# Input tokens read from the vendor's prompt cache are counted separately and priced at the cached input price
+# when the price table has one (tokens written to the Anthropic cache are priced as plain input).
+
+phases = ["query", "condense", "comparison"]
+
+def extract_usage(json_data):
+  """The (input tokens, output tokens, cached input tokens) reported in a response or None if there is no usage.
+     The input tokens include the cached ones."""
+  if not isinstance(json_data, dict):
+    return None
+  usage = json_data.get("usage")
+  if isinstance(usage, dict):
+    if "input_tokens" in usage: # Anthropic (input tokens exclude those read from or written to the cache)
+      cached = usage.get("cache_read_input_tokens") or 0
+      written = usage.get("cache_creation_input_tokens") or 0
+      return ((usage.get("input_tokens") or 0) + cached + written, usage.get("output_tokens") or 0, cached)
+    if "prompt_tokens" in usage: # OpenAI and compatible APIs
+      details = usage.get("prompt_tokens_details") or {}
+      return (usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0, details.get("cached_tokens") or 0)
+  usage = json_data.get("usageMetadata") # Gemini
+  if isinstance(usage, dict):
+    return (usage.get("promptTokenCount") or 0, usage.get("candidatesTokenCount") or 0,
+            usage.get("cachedContentTokenCount") or 0)
+  return None
+
+def price(prices, version, input_tokens, output_tokens, cached_tokens=0):
+  """The cost in dollars of a call or None if the model version has no price"""
+  p = prices.get(version)
+  if p is None:
+    return None
+  cached_price = p[2] if len(p) > 2 else p[0]
+  return ((input_tokens - cached_tokens) * p[0] + cached_tokens * cached_price + output_tokens * p[1]) / 1000000
+
+def total_cost(calls):
+  return sum(call.get("cost") or 0 for call in calls)
+
+def summarize(calls):
+  """Calls, tokens and cost per phase and in total"""
+  def empty():
+    return { "calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "cost": 0.0 }
+  summary = { phase: empty() for phase in phases }
+  summary["total"] = empty()
+  for call in calls:
+    for totals in [summary.setdefault(call["phase"], empty()), summary["total"]]:
+      totals["calls"] += 1
+      totals["input_tokens"] += call.get("input_tokens", 0)
+      totals["cached_tokens"] += call.get("cached_tokens", 0)
+      totals["output_tokens"] += call.get("output_tokens", 0)
+      totals["cost"] += call.get("cost") or 0
+  for totals in summary.values():
+    totals["cost"] = round(totals["cost"], 6)
+  return summary
+
+def describe(summary):
+  """One line per phase with calls for the trail"""
+  lines = []
+  for phase, totals in summary.items():
+    if totals["calls"] == 0:
+      continue
+    lines.append(f"{phase} usage: {totals['calls']} calls, {totals['input_tokens']} input tokens" +
+                 f" ({totals['cached_tokens']} cached)," +
+                 f" {totals['output_tokens']} output tokens, ${totals['cost']:.6f}")
+  return lines
@@ -9,6 +9,9 @@ class Faulty(support.Model):
   def make_query(text):
     return support.make_openai_std_query(text, Faulty.model)
 
+  def make_verdict_query(text):
+    return support.make_openai_verdict_query(text, Faulty.model)
+
   async def ask(session, query):
     if True:
       return "{\"error\": 500 }"
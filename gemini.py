@@ -1,11 +1,22 @@
+import time
+import json
+import hashlib
 import support
+import keypool
 
-gemini_api_key = support.read_file_as_string("gemini-api-key").strip()
+gemini_keys = keypool.read_pool("gemini-api-key")
+
+base_url = "https://generativelanguage.googleapis.com/v1beta/"
+
+# Cached contents made for query prefixes: (api key, model, prefix hash) -> (cached content name, expiry time)
+# (a cached content can only be used with a key of the project that made it)
+cached_contents = {}
 
 class Gemini(support.Model):
   name = "gemini"
   model = "gemini-1.5-flash-latest"
   text_field = "text"
+  host = "https://generativelanguage.googleapis.com"
 
   def make_query_str(text):
     return "{\"contents\":[{\"parts\":[{\"text\":\"" + text + "\"}]}]}"
@@ -20,12 +31,68 @@ class Gemini(support.Model):
     obj["contents"] = contents
     return support.serialize(obj)
   
-  async def ask(session, query):
-    url = "https://generativelanguage.googleapis.com/v1beta/models/" + Gemini.model + ":generateContent?key=" + gemini_api_key
-    headers = {
-        "Content-Type": "application/json"
+  def make_verdict_query(text):
+    obj = { "contents": [{ "parts": [{ "text": text }] }] }
+    obj["generationConfig"] = Gemini.verdict_config()
+    return support.serialize(obj)
+
+  def verdict_config():
+    # constrain the answer to the enum YES or NO
+    return {
+      "temperature": 0,
+      "maxOutputTokens": support.verdict_max_tokens,
+      "responseMimeType": "text/x.enum",
+      "responseSchema": { "type": "STRING", "enum": ["YES", "NO"] }
     }
-    return await support.ask(url, session, query, headers)
+
+  # Prefixes of at least this many tokens (about 4 characters a token) are sent as cached contents
+  # (the API minimum, cached contents also need an explicit model version such as gemini-1.5-flash-002).
+  # None to send the prefix as a system instruction every time.
+  cache_min_tokens = 32768
+  cache_ttl_seconds = 300
+
+  def make_cached_query(prefix, text, verdict=False):
+    obj = { "systemInstruction": { "parts": [{ "text": prefix }] }, "contents": [{ "role": "user", "parts": [{ "text": text }] }] }
+    if verdict:
+      obj["generationConfig"] = Gemini.verdict_config()
+    return support.serialize(obj)
+
+  async def ask(session, query):
+    with gemini_keys.lease() as lease:
+      url = base_url + "models/" + Gemini.model + ":generateContent?key=" + lease.key
+      headers = {
+          "Content-Type": "application/json"
+      }
+      return lease.done(await support.ask(url, session, await use_cached_content(session, query, headers, lease.key), headers))
+
+
+async def use_cached_content(session, query, headers, api_key):
+  """Replace a long enough system instruction in a query with a cached content (made once per ttl)"""
+  if Gemini.cache_min_tokens is None or query.find("\"systemInstruction\"") == -1:
+    return query
+  obj = json.loads(query)
+  prefix = obj["systemInstruction"]["parts"][0]["text"]
+  if len(prefix) < Gemini.cache_min_tokens * 4:
+    return query
+
+  now = time.time()
+  for k, (cached_name, expiry) in list(cached_contents.items()):
+    if expiry < now:
+      cached_contents.pop(k, None) # expired
+  key = (api_key, Gemini.model, hashlib.sha256(prefix.encode()).hexdigest())
+  name, expiry = cached_contents.get(key, (None, 0))
+  if expiry < now + 10:
+    request = { "model": "models/" + Gemini.model, "systemInstruction": obj["systemInstruction"],
+                "ttl": str(Gemini.cache_ttl_seconds) + "s" }
+    response = await support.ask(base_url + "cachedContents?key=" + api_key, session, support.serialize(request), headers)
+    name = None if support.is_error(response) else json.loads(response).get("name")
+    if name is None:
+      return query
+    cached_contents[key] = (name, time.time() + Gemini.cache_ttl_seconds)
+
+  del obj["systemInstruction"]
+  obj["cachedContent"] = name
+  return support.serialize(obj)
   
 
 class Gemini2(Gemini):
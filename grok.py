@@ -1,6 +1,7 @@
 import support 
+import keypool
 
-grok_api_key = support.read_file_as_string("grok-api-key").strip()
+grok_keys = keypool.read_pool("grok-api-key")
 
 url = "https://api.x.ai/v1/chat/completions"
 
@@ -8,16 +9,21 @@ class Grok(support.Model):
  name = "grok"
  model = "grok-beta"
  text_field = "content"
+ host = "https://api.x.ai"
 
  def make_query(text):
    return support.make_openai_std_query(text, Grok.model)
 
+ def make_verdict_query(text):
+   return support.make_openai_verdict_query(text, Grok.model)
+
  async def ask(session, query):
-   headers = {
-     "Content-Type": "application/json",
-     "Authorization": "Bearer " + grok_api_key
-   }
-   return await support.ask(url, session, query, headers)
+   with grok_keys.lease() as lease:
+     headers = {
+       "Content-Type": "application/json",
+       "Authorization": "Bearer " + lease.key
+     }
+     return lease.done(await support.ask(url, session, query, headers))
  
 class Grok2(Grok):
   name = "grok2"
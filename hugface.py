@@ -1,6 +1,7 @@
 import support
+import keypool
 
-hugface_api_key = support.read_file_as_string("hugface-api-key").strip()
+hugface_keys = keypool.read_pool("hugface-api-key")
 
 base_url = "https://api-inference.huggingface.co/models"
 
@@ -8,18 +9,23 @@ class HugFace(support.Model):
   name = "hugface"
   model = "google/gemma-2-2b-it"
   text_field = "content"
+  host = "https://api-inference.huggingface.co"
 
   def make_query(text):
     return support.make_openai_std_query(text, HugFace.model)
 
+  def make_verdict_query(text):
+    return support.make_openai_verdict_query(text, HugFace.model)
+
   async def ask(session, query):
     url = base_url + "/" + HugFace.model + "/v1/chat/completions"
     print(url)
-    headers = {
-      "Content-Type": "application/json",
-      "Authorization": "Bearer " + hugface_api_key
-    }
-    return await support.ask(url, session, query, headers)
+    with hugface_keys.lease() as lease:
+      headers = {
+        "Content-Type": "application/json",
+        "Authorization": "Bearer " + lease.key
+      }
+      return lease.done(await support.ask(url, session, query, headers))
 
 class HugFace2(HugFace):
   name = "hugface2"
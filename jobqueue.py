@@ -0,0 +1,111 @@
+import json
+import time
+import uuid
+import sqlite3
+from contextlib import closing
+
+# A durable local job queue in sqlite (no broker needed) shared by the web app, the batch CLI and worker processes.
+# A claimed job is leased to a worker for the visibility timeout. If the worker crashes (or hangs) and
+# doesn't complete or extend the lease in time the job is delivered again, up to max_attempts times.
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+class JobQueue:
+
+  def __init__(self, path="jobs.db", visibility_timeout=120, max_attempts=3):
+    self.path = path
+    self.visibility_timeout = visibility_timeout
+    self.max_attempts = max_attempts
+    with closing(self.connect()) as db:
+      db.execute("PRAGMA journal_mode=WAL")
+      db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                      id TEXT PRIMARY KEY,
+                      prompt TEXT NOT NULL,
+                      action TEXT NOT NULL,
+                      config TEXT NOT NULL,
+                      state TEXT NOT NULL,
+                      attempts INTEGER NOT NULL DEFAULT 0,
+                      worker TEXT,
+                      lease_until REAL,
+                      created REAL NOT NULL,
+                      finished REAL,
+                      result TEXT,
+                      error TEXT)""")
+      db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)")
+
+  def connect(self):
+    db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+    db.row_factory = sqlite3.Row
+    return db
+
+  def enqueue(self, prompt, action, config_snapshot):
+    id = uuid.uuid4().hex
+    with closing(self.connect()) as db:
+      db.execute("INSERT INTO jobs (id, prompt, action, config, state, created) VALUES (?, ?, ?, ?, ?, ?)",
+                 (id, prompt, action, json.dumps(config_snapshot), QUEUED, time.time()))
+    return id
+
+  def claim(self, worker):
+    """Lease the oldest job waiting (or whose lease expired) to a worker. None if there is nothing to do."""
+    db = self.connect()
+    try:
+      db.execute("BEGIN IMMEDIATE")
+      now = time.time()
+      # jobs whose worker died on the last attempt can't be delivered again
+      db.execute("UPDATE jobs SET state = ?, error = ?, finished = ? WHERE state = ? AND lease_until < ? AND attempts >= ?",
+                 (FAILED, "lease expired", now, RUNNING, now, self.max_attempts))
+      row = db.execute("SELECT * FROM jobs WHERE state = ? OR (state = ? AND lease_until < ?) ORDER BY created LIMIT 1",
+                       (QUEUED, RUNNING, now)).fetchone()
+      if row is None:
+        db.execute("COMMIT")
+        return None
+      db.execute("UPDATE jobs SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                 (RUNNING, worker, now + self.visibility_timeout, row["id"]))
+      db.execute("COMMIT")
+    except Exception:
+      if db.in_transaction: db.execute("ROLLBACK")
+      raise
+    finally:
+      db.close()
+    job = dict(row)
+    job["config"] = json.loads(job["config"])
+    job["attempts"] += 1
+    return job
+
+  def extend(self, id, worker):
+    """Renew the lease of a job still being worked on. False if the lease was lost to another worker."""
+    with closing(self.connect()) as db:
+      cursor = db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = ?",
+                          (time.time() + self.visibility_timeout, id, worker, RUNNING))
+      return cursor.rowcount == 1
+
+  def complete(self, id, worker, result):
+    with closing(self.connect()) as db:
+      db.execute("UPDATE jobs SET state = ?, result = ?, finished = ?, lease_until = NULL WHERE id = ? AND worker = ?",
+                 (DONE, json.dumps(result), time.time(), id, worker))
+
+  def fail(self, id, worker, error):
+    """Put a failed job back in the queue or fail it for good after max_attempts"""
+    with closing(self.connect()) as db:
+      db.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, lease_until = NULL," +
+                 " finished = CASE WHEN attempts >= ? THEN ? ELSE NULL END WHERE id = ? AND worker = ?",
+                 (self.max_attempts, FAILED, QUEUED, error, self.max_attempts, time.time(), id, worker))
+
+  def get(self, id):
+    with closing(self.connect()) as db:
+      row = db.execute("SELECT id, prompt, action, state, attempts, created, finished, result, error FROM jobs WHERE id = ?",
+                       (id,)).fetchone()
+    if row is None:
+      return None
+    job = dict(row)
+    if job["result"] is not None:
+      job["result"] = json.loads(job["result"])
+    return job
+
+  def counts(self):
+    with closing(self.connect()) as db:
+      rows = db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+    return { row[0]: row[1] for row in rows }
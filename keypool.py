@@ -0,0 +1,149 @@
+import json
+import time
+import asyncio
+import threading
+import support
+import costs
+
+# Pools of api keys so a provider's throughput isn't capped by the rate limits of one key.
+# A key file holds one key per line (blank lines and lines starting with # are skipped).
+# Each request leases the key with the fewest requests in flight, then the most rate limit headroom left
+# (from the x-ratelimit-remaining-requests or anthropic-ratelimit-requests-remaining header of its last response),
+# then the one used least recently. A key answered with 429 (or 401, 402, 403) or with no requests left is taken out
+# for the Retry-After seconds or cooldown_seconds. If every key is out the one back soonest is used.
+#
+#   with openai_keys.lease() as lease:
+#     headers = { "Authorization": "Bearer " + lease.key }
+#     return lease.done(await support.ask(url, session, query, headers))
+
+cooldown_seconds = 30
+cooldown_statuses = [401, 402, 403, 429]
+
+# Pools by key file for the usage report
+pools = {}
+
+def configure(seconds):
+  global cooldown_seconds
+  cooldown_seconds = seconds
+
+class Key:
+  def __init__(self, key):
+    self.key = key
+    self.in_flight = 0
+    self.requests = 0
+    self.errors = 0
+    self.rate_limited = 0
+    self.input_tokens = 0
+    self.output_tokens = 0
+    self.remaining = None # requests left in the rate limit window (if the API says)
+    self.cooling_until = 0
+    self.last_used = 0
+
+  def label(self):
+    return "..." + self.key[-4:]
+
+  def headroom(self):
+    return float("inf") if self.remaining is None else self.remaining
+
+class KeyPool:
+
+  def __init__(self, name, keys):
+    self.name = name
+    self.keys = [Key(key) for key in keys]
+    self.no_key = Key("") # leased when the key file has no keys (the API then answers with an error)
+    self.lock = threading.Lock()
+
+  def first(self):
+    return self.keys[0].key if len(self.keys) > 0 else ""
+
+  def acquire(self):
+    with self.lock:
+      now = time.time()
+      if len(self.keys) == 0:
+        self.no_key.in_flight += 1
+        return self.no_key
+      available = [key for key in self.keys if key.cooling_until <= now]
+      if len(available) == 0:
+        key = min(self.keys, key=lambda k: k.cooling_until)
+      else:
+        key = min(available, key=lambda k: (k.in_flight, -k.headroom(), k.last_used))
+      key.in_flight += 1
+      key.last_used = now
+      return key
+
+  def release(self, key, stats, response):
+    with self.lock:
+      key.in_flight -= 1
+      key.requests += 1
+      status = stats.get("status")
+      if "ratelimit_remaining" in stats:
+        key.remaining = stats["ratelimit_remaining"]
+      if status in cooldown_statuses or key.remaining == 0:
+        key.rate_limited += 1 if status == 429 else 0
+        key.cooling_until = time.time() + (stats.get("retry_after") or cooldown_seconds)
+        key.remaining = None
+      if support.is_error(response):
+        key.errors += 1
+        return
+      usage = costs.extract_usage(json.loads(response))
+      if usage is not None:
+        key.input_tokens += usage[0]
+        key.output_tokens += usage[1]
+
+  def cancel(self, key):
+    """A request cut off (e.g. a speculative comparison no longer needed) says nothing about the key"""
+    with self.lock:
+      key.in_flight -= 1
+
+  def lease(self):
+    return Lease(self)
+
+  def usage(self):
+    with self.lock:
+      now = time.time()
+      return [{ "key": key.label(), "requests": key.requests, "in_flight": key.in_flight, "errors": key.errors,
+                "rate_limited": key.rate_limited, "input_tokens": key.input_tokens, "output_tokens": key.output_tokens,
+                "remaining": key.remaining, "cooling_seconds": round(max(0, key.cooling_until - now), 1) }
+              for key in self.keys]
+
+class Lease:
+  """A key leased for one request. Takes the transport statistics of the request to see how the key fared
+     (and passes them on to the call being recorded)."""
+
+  def __init__(self, pool):
+    self.pool = pool
+    self.response = None
+
+  def __enter__(self):
+    self.entry = self.pool.acquire()
+    self.key = self.entry.key
+    self.outer = support.call_stats.get()
+    self.stats = {}
+    self.token = support.call_stats.set(self.stats)
+    return self
+
+  def done(self, response):
+    self.response = response
+    return response
+
+  def __exit__(self, exc_type, exc, traceback):
+    support.call_stats.reset(self.token)
+    if self.outer is not None:
+      self.outer.update(self.stats)
+    if exc_type is asyncio.CancelledError:
+      self.pool.cancel(self.entry)
+    else:
+      self.pool.release(self.entry, self.stats, self.response)
+    return False
+
+def read_pool(file_name):
+  """The pool of keys in a key file"""
+  content = support.read_file_as_string(file_name) or ""
+  lines = [line.strip() for line in content.splitlines()]
+  keys = [line for line in lines if line != "" and not line.startswith("#")]
+  pool = pools[file_name] = KeyPool(file_name, keys)
+  return pool
+
+def report():
+  """Usage per key of every pool"""
+  return { name: pool.usage() for name, pool in pools.items() }
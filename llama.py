@@ -1,6 +1,7 @@
 import support 
+import keypool
 
-llama_api_key = support.read_file_as_string("llama-api-key").strip()
+llama_keys = keypool.read_pool("llama-api-key")
 
 url = "https://api.llama-api.com/chat/completions"
 
@@ -9,16 +10,21 @@ class Llama(support.Model):
   model = "llama3.2-3b"
   
   text_field = "content"
+  host = "https://api.llama-api.com"
 
   def make_query(text):
     return support.make_openai_std_query(text, Llama.model)
 
+  def make_verdict_query(text):
+    return support.make_openai_verdict_query(text, Llama.model)
+
   async def ask(session, query):
-    headers = {
-      "Content-Type": "application/json",
-      "Authorization": "Bearer " + llama_api_key
-    }
-    return await support.ask(url, session, query, headers)
+    with llama_keys.lease() as lease:
+      headers = {
+        "Content-Type": "application/json",
+        "Authorization": "Bearer " + lease.key
+      }
+      return lease.done(await support.ask(url, session, query, headers))
   
 class Llama2(Llama):
   name = "llama2"
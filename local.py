@@ -0,0 +1,99 @@
+import asyncio
+import weakref
+import threading
+from collections import deque
+import aiohttp
+import support
+
+# A local OpenAI compatible inference server on this host (llama.cpp server, Ollama, vLLM ...)
+# used as an answer model or a comparator without any internet round trip.
+# Connects over TCP or the server's Unix socket (with the aiohttp transport) and limits the requests it is sent at once
+# as a local server serves only a few in parallel. No api key file is needed.
+
+# Sessions over the Unix socket per event loop
+sessions = weakref.WeakKeyDictionary()
+
+class Limiter:
+  """Limits the requests in flight to Local.max_concurrency across the process. Requests can come from several
+     event loops (Flask serves each request in its own thread and loop) so waiters are woken thread safely."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.in_flight = 0
+    self.waiters = deque() # (loop, future) in order of arrival
+
+  async def __aenter__(self):
+    loop = asyncio.get_running_loop()
+    with self.lock:
+      if self.in_flight < Local.max_concurrency and len(self.waiters) == 0:
+        self.in_flight += 1
+        return
+      waiter = (loop, loop.create_future())
+      self.waiters.append(waiter)
+    try:
+      await waiter[1]
+    except asyncio.CancelledError:
+      with self.lock:
+        if waiter in self.waiters:
+          self.waiters.remove(waiter)
+          raise
+      if waiter[1].done() and not waiter[1].cancelled():
+        self.release() # granted just before being cancelled so pass it on
+      raise
+
+  async def __aexit__(self, *exc):
+    self.release()
+
+  def release(self):
+    with self.lock:
+      while len(self.waiters) > 0:
+        loop, future = self.waiters.popleft()
+        if not loop.is_closed():
+          loop.call_soon_threadsafe(self.grant, future) # the slot goes to the waiter
+          return
+      self.in_flight -= 1
+
+  def grant(self, future):
+    if future.done(): # cancelled meanwhile
+      self.release()
+    else:
+      future.set_result(None)
+
+limiter = Limiter()
+
+def get_session(session):
+  """A session connecting over the Unix socket if one is configured otherwise the given session"""
+  if Local.unix_socket is None:
+    return session
+  loop = asyncio.get_running_loop()
+  unix_session = sessions.get(loop)
+  if unix_session is None or unix_session.closed:
+    unix_session = aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=Local.unix_socket), timeout=session.timeout)
+    sessions[loop] = unix_session
+  return unix_session
+
+async def close():
+  session = sessions.pop(asyncio.get_running_loop(), None)
+  if session is not None:
+    await session.close()
+
+class Local(support.Model):
+  name = "local"
+  model = "llama3.2:3b" # the model the server is to use (servers serving a single model ignore it)
+  text_field = "content"
+  host = "http://127.0.0.1:8080"
+  unix_socket = None # path of the server's Unix socket (the host is then only used in the url)
+  max_concurrency = 2
+
+  def make_query(text):
+    return support.make_openai_std_query(text, Local.model)
+
+  def make_verdict_query(text):
+    return support.make_openai_verdict_query(text, Local.model)
+
+  async def ask(session, query):
+    headers = {
+      "Content-Type": "application/json"
+    }
+    async with limiter:
+      return await support.ask(Local.host + "/v1/chat/completions", get_session(session), query, headers)
@@ -3,6 +3,10 @@ import asyncio
 import aiohttp
 import time
 import json
+import contextvars
+import threading
+import weakref
+import contextlib
 
 # Add current directory to import path when using this file as a module. Say with "from <some-dir> import multillm".
 from pathlib import Path
@@ -10,120 +14,458 @@ sys.path.append(str(Path(__file__).parent))
 
 from config import models, schedule, comparison_models, comparison_schedule, configure
 from config import get_diff_comparator, max_no_models, set_trail_only, display, debug, client_timeout_seconds
+from config import quorum_batch_size, adaptive_selection, condense_responses, condense_min_chars, batch_comparisons
+from config import verdict_mode, warm_up, warm_up_connections_per_host, warm_up_interval_seconds
+from config import keepalive_seconds, dns_cache_seconds
+from config import response_byte_limits, response_char_limits, max_response_chars, show_calls
+from config import semantic_cache, model_prices, get_max_cost_per_request, show_usage, batch_price_factor
+from config import record_runs, run_store_file, speculative_comparisons, comparator_balancing
+from config import pipe_max_in_flight, pipe_ordered
 import support
-from comparison import make_comparison
+import selector
+import semcache
+import costs
+import local
+from runstore import RunStore
+from comparison import make_comparison, make_batch_comparison, parse_batch_verdicts
+from comparison import split_cached_prefix
+import comparison
 
 timeout = aiohttp.ClientTimeout(total=client_timeout_seconds)
 
+# A connector (connection pool) per event loop shared by all sessions when warming up connections
+connectors = weakref.WeakKeyDictionary()
+
+def get_connector():
+  loop = asyncio.get_running_loop()
+  connector = connectors.get(loop)
+  if connector is None or connector.closed:
+    connector = aiohttp.TCPConnector(keepalive_timeout=keepalive_seconds, ttl_dns_cache=dns_cache_seconds)
+    connectors[loop] = connector
+  return connector
+
 def getSession():
+   if warm_up:
+     return aiohttp.ClientSession(timeout=timeout, connector=get_connector(), connector_owner=False)
    return aiohttp.ClientSession(timeout=timeout) 
 
+async def warm_up_connections():
+  """Resolve and open pooled connections to the hosts of the scheduled models and comparators"""
+  hosts = []
+  for model in scheduled_models() + scheduled_comparison_models():
+    if model is local.Local and local.Local.unix_socket is not None:
+      continue # its own session over the socket
+    if model.host is not None and support.rewrite_url(model.host) not in hosts:
+      hosts.append(support.rewrite_url(model.host))
+
+  async def open_connection(session, host):
+    try:
+      async with session.head(host) as response:
+        await response.read()
+      return True
+    except Exception as e:
+      print(f"Failed to warm up {host}: {e.__class__.__name__}")
+      return False
+
+  async with getSession() as session:
+    promises = []
+    for host in hosts:
+      for i in range(warm_up_connections_per_host):
+        promises.append(open_connection(session, host))
+    await asyncio.gather(*promises)
+
+async def keep_warm():
+  """Refresh the pooled connections periodically (run as a task in long running processes)"""
+  while True:
+    await asyncio.sleep(warm_up_interval_seconds)
+    await warm_up_connections()
+
+async def close_connections():
+  connector = connectors.pop(asyncio.get_running_loop(), None)
+  if connector is not None:
+    await connector.close()
+  await support.http_transport.close()
+  await local.close()
+
+async def read_line(prompt_text):
+  """input() without blocking the event loop (so tasks like keep_warm can run while waiting)"""
+  loop = asyncio.get_running_loop()
+  future = loop.create_future()
+
+  def read():
+    try:
+      line = input(prompt_text)
+      loop.call_soon_threadsafe(lambda: future.done() or future.set_result(line))
+    except Exception as e:
+      error = e
+      loop.call_soon_threadsafe(lambda: future.done() or future.set_exception(error))
+
+  threading.Thread(target=read, daemon=True).start()
+  return await future
+
+# State of the current run_comparison call (the order of models to use, the answers received and the calls made)
+run_state = contextvars.ContextVar("run_state", default=None)
+
+def make_schedule_order():
+  scheduled = [model for model in models if schedule[model.name]]
+  scheduled_comparisons = [cm for cm in comparison_models if comparison_schedule[cm.name]]
+  if adaptive_selection:
+    scheduled = selector.order(scheduled)
+    scheduled_comparisons = selector.order(scheduled_comparisons, False)
+  return (scheduled, scheduled_comparisons)
+
+def get_run_state():
+  state = run_state.get()
+  if state is None:
+    # not within run_comparison so follow the schedule as it is now
+    state = { "order": make_schedule_order(), "answers": {}, "calls": [], "budget": None }
+  return state
+
+def over_budget():
+  """True (noting it in the run state) if the calls made so far have used up the budget of the run"""
+  state = get_run_state()
+  if state["budget"] is None or costs.total_cost(state["calls"]) < state["budget"]:
+    return False
+  state["budget_exceeded"] = True
+  return True
+
+def scheduled_models():
+  """The scheduled models in the order of preference for this run"""
+  return get_run_state()["order"][0]
+
+def scheduled_comparison_models():
+  """The scheduled comparison models in the order of preference for this run"""
+  return get_run_state()["order"][1]
+
 def get_model(i):
-  for model in models:
-     if not schedule[model.name]:
-       continue
-     if i == 0:
-       return model
-     else:
-        i -= 1
+  scheduled = scheduled_models()
+  if i < len(scheduled):
+    return scheduled[i]
+  return None
 
 def get_comparison_model(i):
-  for cm in comparison_models:
-    if not comparison_schedule[cm.name]:
-      continue
-    if i == 0:
-      return cm
-    else:
-      i -= 1
-  return get_comparison_model(i)
+  scheduled = scheduled_comparison_models()
+  return scheduled[i % len(scheduled)]
+
+# Requests in flight per model (across runs) for least-outstanding comparator balancing
+outstanding = {}
+outstanding_lock = threading.Lock()
+
+def count_outstanding(name, n):
+  with outstanding_lock:
+    outstanding[name] = outstanding.get(name, 0) + n
 
 def get_diff_comparison_model(model1, model2):
-  comparison_model = None
-  for cm in comparison_models:
-    if not comparison_schedule[cm.name]:
-      continue
-    if cm.name != model1.name and cm.name != model2.name:
-      comparison_model = cm
-      break
-  if comparison_model is None:
+  eligible = [cm for cm in scheduled_comparison_models() if cm.name != model1.name and cm.name != model2.name]
+  if len(eligible) == 0:
     raise RuntimeError("Couldn't find a different comparison model to use for comparison")
-  else:
-    return comparison_model
+  if comparator_balancing is None:
+    return eligible[0]
+
+  # spread the pairs of the run over the eligible comparators, the first in order of preference on a tie
+  state = get_run_state()
+  assigned = state.setdefault("assigned", {}) # comparisons given to each comparator in the run
+  pending = state.setdefault("pending", {})   # of which not done yet (see release_comparator)
+  if comparator_balancing == "least-outstanding" and precomputed.get() is None:
+    load = lambda cm: outstanding.get(cm.name, 0) + pending.get(cm.name, 0)
+  else: # round-robin (also in batch API runs as the comparators have to be the same every round)
+    load = lambda cm: assigned.get(cm.name, 0)
+  comparison_model = min(eligible, key=load)
+  assigned[comparison_model.name] = assigned.get(comparison_model.name, 0) + 1
+  pending[comparison_model.name] = pending.get(comparison_model.name, 0) + 1
+  return comparison_model
+
+def release_comparator(model):
+  """A comparison assigned to a comparator is done or dropped"""
+  pending = get_run_state().get("pending", {})
+  if pending.get(model.name, 0) > 0:
+    pending[model.name] -= 1
+
+def set_quorum(names):
+  """Note the models whose answers agree on the compared response (the winning quorum of the run)"""
+  get_run_state()["quorum"] = list(names)
 
 async def multi_way_query(prompt, max_models = max_no_models):
   """Query the configured models in parallel and gather the responses"""
   promises = []
   async with getSession() as session:
 
-    i = 0
-    for model in models:
-      if schedule[model.name]:
-        promise = model.ask(session, model.make_query(prompt))
-        promises.append(promise)
-        i += 1
-        if i == max_models:
-          break
+    for model in scheduled_models()[:max_models]:
+      promise = ask_model(model, session, model.make_query(prompt))
+      promises.append(promise)
 
     responses = await asyncio.gather(*promises)
   
   return responses
 
+# Responses made ahead of time (see batchapi.py). When set, ask_model answers from its responses
+# (a dict of (model name, query) -> response) and adds any other query to its pending dict
+# ((model name, query) -> model) raising PendingCall instead of asking the model.
+precomputed = contextvars.ContextVar("precomputed", default=None)
+
+class PendingCall(Exception):
+  """A query to make before the run can go on"""
+  pass
+
+async def ask_model(model, session, query, phase="query", call=None):
+  """Ask a model, recording the call (with its transport statistics) in the run state
+     and keeping statistics of its latency and errors when selecting models adaptively.
+     call is the record to fill in if the caller adds to it."""
+  if call is None:
+    call = { "model": model.name, "phase": phase }
+  call["version"] = model.model
+  batch = precomputed.get()
+  if batch is not None:
+    return answer_precomputed(batch, model, query, call)
+  start = time.time()
+  token = support.response_byte_limit.set(response_byte_limits.get(model.name))
+  stats_token = support.call_stats.set(call)
+  count_outstanding(model.name, 1)
+  try:
+    response = await model.ask(session, query)
+  finally:
+    count_outstanding(model.name, -1)
+    support.response_byte_limit.reset(token)
+    support.call_stats.reset(stats_token)
+  call["ms"] = round((time.time() - start) * 1000, 1)
+  call["ok"] = not support.is_error(response)
+  call["response_size"] = 0 if response is None else len(response)
+  if call["ok"]:
+    record_usage(call, model, json.loads(response))
+  get_run_state()["calls"].append(call)
+  if adaptive_selection:
+    selector.record_call(model.name, time.time() - start, call["ok"])
+  return response
+
+def answer_precomputed(batch, model, query, call):
+  key = (model.name, query)
+  if key not in batch.responses:
+    batch.pending[key] = model
+    raise PendingCall(model.name)
+  response = batch.responses[key]
+  call["ms"] = 0
+  call["batch"] = True
+  call["ok"] = not support.is_error(response)
+  call["response_size"] = len(response)
+  if call["ok"]:
+    record_usage(call, model, json.loads(response))
+  get_run_state()["calls"].append(call)
+  return response
+
+def record_usage(call, model, json_data):
+  usage = costs.extract_usage(json_data)
+  if usage is None:
+    return
+  call["input_tokens"], call["output_tokens"], call["cached_tokens"] = usage
+  call["cost"] = costs.price(model_prices, model.model, *usage)
+  if call["cost"] is not None and call.get("batch") and model.batch_api is not None:
+    call["cost"] *= batch_price_factor
+
+def display_calls(calls, trail):
+  """Show the calls made in a run with their transport statistics"""
+  for call in calls:
+    line = f"{call['phase']} {call['model']} {call['ms']} ms"
+    if "bytes_sent" in call:
+      line += f", {call.get('http_version', '')} headers after {call.get('headers_ms', '-')} ms," + \
+              f" sent {call['bytes_sent']} bytes, received {call.get('bytes_received', '-')} bytes"
+      if call.get("content_encoding") is not None:
+        line += " (" + call["content_encoding"] + ")"
+    if not call["ok"]:
+      line += " failed"
+    display(trail, line)
+
+async def query_model(session, model, prompt, trail=None):
+  """Query a single model and return its response text or an empty string if it failed to answer"""
+  response = await ask_model(model, session, model.make_query(prompt))
+  if response is None or response.strip() == "":
+    text = None
+  else:
+    json_data = json.loads(response)
+    if trail is not None: show_dropped(model, json_data, trail)
+    text = support.search_json(json_data, model.text_field)
+  if text is None:
+    text = ""
+  elif trail is not None:
+    text = limit_text(model, text, trail)
+  get_run_state()["answers"][model.name] = text
+  await condense_texts(session, [text])
+  return text
+
+async def condense_texts(session, texts, trail=None):
+  """Make the condensed forms of long response texts to compare (once per response) if configured"""
+  if condense_responses is None:
+    return
+  texts = [text for text in texts if len(text) > condense_min_chars and not comparison.is_condensed(text)]
+  if condense_responses == "model" and len(texts) > 0:
+    model = get_comparison_model(0)
+    promises = [query_condensed(session, model, text) for text in texts]
+    condensed = await asyncio.gather(*promises)
+  else:
+    condensed = [comparison.condense(text, condense_min_chars) for text in texts]
+  for i in range(len(texts)):
+    comparison.set_condensed(texts[i], condensed[i])
+    if debug and trail is not None: display(trail, "condensed to: " + condensed[i])
+
+async def query_condensed(session, model, text):
+  """Ask a model for the short final answer form of a response falling back on local extraction"""
+  response = await ask_model(model, session, model.make_query(clean(comparison.make_condense_query(text))), "condense")
+  condensed = None
+  if not support.is_error(response):
+    condensed = support.search_json(json.loads(response), model.text_field)
+  if condensed is None or condensed.strip() == "":
+    return comparison.condense(text, condense_min_chars)
+  return condensed.strip()
+
+clean_table = str.maketrans({ "\n": "\\n", '"': '\\"' })
+
 def clean(str):
-  str1 = str.replace("\n", "\\n")
-  str2 = str1.replace('"', '\\"')
-  return str2
+  return str.translate(clean_table)
+
+def limit_text(model, text, trail):
+  """Truncate a response text to the character limit for the model, noting it in the trail"""
+  limit = response_char_limits.get(model.name, max_response_chars)
+  if len(text) <= limit:
+    return text
+  display(trail, f"response from {model.name} truncated from {len(text)} to {limit} characters")
+  return text[:limit]
+
+def show_dropped(model, json_data, trail):
+  if isinstance(json_data, dict) and json_data.get("error") == "response too large":
+    display(trail, f"response from {model.name} dropped as larger than {json_data['limit']} bytes")
 
 def parse_responses(responses, trail, verbose=False):
   """Parsing out the model specific text field. Display responses if display flag is True"""
   response_texts = []
+  answers = get_run_state()["answers"]
   i = 0
-  for model in models:
-    if not schedule[model.name]:
-      if debug: display(trail, "skiped " + model.name)
-      continue
+  for model in scheduled_models():
     if verbose: display(trail, "model " + model.name)
     response = responses[i]
     if response is None or response == "":
       response = "{}"
     
     json_data = json.loads(response)
-    json_formatted_str = json.dumps(json_data, indent=2)
-    if debug: print(json_formatted_str)
+    if debug: print(json.dumps(json_data, indent=2))
+    show_dropped(model, json_data, trail)
     text = support.search_json(json_data, model.text_field)
     if text != None and text.strip() != "":
+      text = limit_text(model, text, trail)
       if verbose: display(trail, text)
       response_texts.append(text)
     else:
       if verbose: display(trail, "No response text found!")
       response_texts.append("")
+    answers[model.name] = response_texts[-1]
     i += 1
     if i == len(responses):
       break
   return response_texts
 
-async def compare(session, model, comparison, trail, verbose = False):
-  if comparison is None or comparison == "":
-    return False
+def make_comparison_query(model, comparison, verdict=False):
+  """A comparison query with the static prefix of the comparison (if laid out for caching) marked to be cached
+     where the API needs that"""
+  prefix, text = split_cached_prefix(comparison)
+  if prefix != "" and model.make_cached_query is not None:
+    return model.make_cached_query(clean(prefix), clean(text), verdict)
+  comparison = prefix + text # (without the cache break)
+  if verdict:
+    return model.make_verdict_query(clean(comparison))
+  return model.make_query(clean(comparison))
+
+async def compare(session, model, comparison, trail, verbose = False, pair=None):
+  """Ask a comparator if two answers agree. pair is the names of the models that gave them (for the run store).
+     Counts as done the comparison assigned to the comparator (see get_diff_comparison_model)."""
+  try:
+    if comparison is None or comparison == "":
+      return False
+    if over_budget():
+      return False
   
-  query = model.make_query(clean(comparison))
-  if debug: print(query)
-  response = await model.ask(session, query)
-  if response is None or response.strip() == "":
-    response = "{}"
-  json_data = json.loads(response)
-  if verbose:
-    json_formatted_str = json.dumps(json_data, indent=2)
-    if debug: print(json_formatted_str)
-  text = support.search_json(json_data, model.text_field)
-  if text is None:
-    if verbose: display(trail, f"comparison using {model.name} failed!")
-    return False
-  if verbose: display(trail, f"comparison using {model.name} result:\n" + text)
-
-  if text.find("YES") != -1 and text.find("NO") == -1:
-    return True
-  else:
-    return False
+    # (make_comparison ends the comparison with the verdict instructions in verdict mode)
+    query = make_comparison_query(model, comparison, verdict_mode)
+    if debug: print(query)
+    call = { "model": model.name, "phase": "comparison" }
+    response = await ask_model(model, session, query, "comparison", call)
+    if response is None or response.strip() == "":
+      response = "{}"
+    json_data = json.loads(response)
+    if verbose:
+      json_formatted_str = json.dumps(json_data, indent=2)
+      if debug: print(json_formatted_str)
+    text = support.search_json(json_data, model.text_field)
+    if text is None:
+      if verbose: display(trail, f"comparison using {model.name} failed!")
+      return False
+    if verbose: display(trail, f"comparison using {model.name} result:\n" + text)
+
+    agreed = support.parse_verdict(text) == True
+    if pair is not None: call["verdicts"] = [[pair[0], pair[1], agreed]]
+    return agreed
+  finally:
+    release_comparator(model)
+
+async def compare_batched(session, prompt, pairs, comparators, trail, verbose = False, names=None):
+  """Compare pairs of answers (label1, answer1, label2, answer2) with the comparator given for each pair
+     (names is the pairs of names of the models that gave the answers).
+     The pairs of each comparator go in one request asking for a JSON verdict list.
+     Falls back on comparing the pairs one at a time if the verdicts can't be parsed."""
+  agreed = [False] * len(pairs)
+  groups = {}
+  for p in range(len(pairs)):
+    label1, answer1, label2, answer2 = pairs[p]
+    if answer1.strip() == "" or answer2.strip() == "":
+      release_comparator(comparators[p])
+      continue
+    groups.setdefault(comparators[p], []).append(p)
+
+  async def compare_group(model, group):
+    one_at_a_time = False
+    try:
+      answers = []
+      labels = {}
+      batch_pairs = []
+      for p in group:
+        label1, answer1, label2, answer2 = pairs[p]
+        for label, answer in [(label1, answer1), (label2, answer2)]:
+          if label not in labels:
+            labels[label] = len(answers)
+            answers.append((label, answer))
+        batch_pairs.append((labels[label1], labels[label2]))
+
+      verdicts = None
+      if over_budget():
+        return
+      if len(group) > 1:
+        comparison = make_batch_comparison(prompt, answers, batch_pairs)
+        if debug: display(trail, comparison)
+        call = { "model": model.name, "phase": "comparison" }
+        response = await ask_model(model, session, make_comparison_query(model, comparison), "comparison", call)
+        if not support.is_error(response):
+          text = support.search_json(json.loads(response), model.text_field)
+          if text is not None:
+            if verbose: display(trail, f"batched comparison using {model.name} result:\n" + text)
+            verdicts = parse_batch_verdicts(text, len(group))
+            if verdicts is not None and names is not None:
+              call["verdicts"] = [[names[group[i]][0], names[group[i]][1], verdicts[i]] for i in range(len(group))]
+        if verdicts is None:
+          display(trail, f"batched comparison using {model.name} failed, comparing {len(group)} pairs one at a time")
+      if verdicts is None:
+        one_at_a_time = True # (compare counts the pairs as done)
+        promises = []
+        for p in group:
+          label1, answer1, label2, answer2 = pairs[p]
+          promises.append(compare(session, model, make_comparison(prompt, label1, answer1, label2, answer2),
+                                  trail=trail, verbose=verbose, pair=None if names is None else names[p]))
+        verdicts = await asyncio.gather(*promises)
+      for i in range(len(group)):
+        agreed[group[i]] = verdicts[i]
+    finally:
+      if not one_at_a_time:
+        for p in group:
+          release_comparator(model)
+
+  await asyncio.gather(*[compare_group(model, group) for model, group in groups.items()])
+  return agreed
 
 def ensure_texts(texts, count, trail):
    if len(texts) < 2:
@@ -146,13 +488,50 @@ async def compare_one_way(prompt, texts, trail, verbose = False):
     else:
       model = get_comparison_model(0)
     if verbose: display(trail, f"using model {model.name} for comparison")
-    if await compare(session, model, comparison, verbose):
+    if await compare(session, model, comparison, trail, verbose, pair=(get_model(0).name, get_model(1).name)):
       if verbose: display(trail, f"comparison {model.name} succeeds, can use {get_model(0).name}")
+      set_quorum([get_model(0).name, get_model(1).name])
       return alice
     else:
       return None
     
 
+async def compare_speculatively(session, comparisons, trail, verbose = False):
+  """Run comparisons (comparator, comparison, pair) overlapping as configured by speculative_comparisons.
+     Returns the index of the first comparison in order that agrees or None, cancelling those still running."""
+  tasks = []
+  started = set() # the comparisons handed to compare (which counts them as done)
+
+  loop = asyncio.get_running_loop()
+  launch = loop.time()
+
+  async def start(i):
+    comparator, comparison, pair = comparisons[i]
+    if i > 0 and speculative_comparisons > 0:
+      # start i delays after the first or as soon as the comparison before has answered
+      await asyncio.wait([tasks[i - 1]], timeout=max(0, launch + i * speculative_comparisons - loop.time()))
+      if tasks[i - 1].done() and not tasks[i - 1].cancelled() and tasks[i - 1].exception() is None and tasks[i - 1].result():
+        return False # not needed
+    started.add(i)
+    return await compare(session, comparator, comparison, trail=trail, verbose=verbose, pair=pair)
+
+  for i in range(len(comparisons)):
+    tasks.append(asyncio.create_task(start(i)))
+  try:
+    for i in range(len(tasks)):
+      if await tasks[i]:
+        return i
+    return None
+  finally:
+    cancelled = [task for task in tasks if not task.done()]
+    for task in cancelled:
+      task.cancel()
+    await asyncio.gather(*cancelled, return_exceptions=True)
+    for i in range(len(comparisons)):
+      if i not in started:
+        release_comparator(comparisons[i][0]) # dropped before it started
+    if verbose and len(cancelled) > 0: display(trail, f"cancelled {len(cancelled)} comparisons no longer needed")
+
 async def compare_two_or_three_way(prompt, texts, two_way_only, trail, verbose = False):
   """Compare the first 3 result texts 2 or 3 way. Return None if no matches"""
   ensure_texts(texts, 3, trail)
@@ -165,6 +544,9 @@ async def compare_two_or_three_way(prompt, texts, two_way_only, trail, verbose =
   comparison1 =  make_comparison(prompt, "Alice", alice, "Bob", bob)
   if debug: display(trail, comparison1)
 
+  if speculative_comparisons is not None and precomputed.get() is None:
+    return await compare_two_or_three_way_speculatively(prompt, texts, two_way_only, trail, verbose)
+
   async with getSession() as session:
     
     if get_diff_comparator():
@@ -173,8 +555,9 @@ async def compare_two_or_three_way(prompt, texts, two_way_only, trail, verbose =
       model = get_comparison_model(0)
     if verbose: display(trail, f"using model {model.name} for comparison")
 
-    if await compare(session, model, comparison1, verbose):
+    if await compare(session, model, comparison1, trail, verbose, pair=(get_model(0).name, get_model(1).name)):
         if verbose: display(trail, f"comparison {model.name} succeeds, can use {get_model(0).name}")
+        set_quorum([get_model(0).name, get_model(1).name])
         return alice
     else:
         comparison2 =  make_comparison(prompt, "Alice", alice, "Eve", eve)
@@ -186,8 +569,9 @@ async def compare_two_or_three_way(prompt, texts, two_way_only, trail, verbose =
           model = get_comparison_model(1)
         if verbose: display(trail, f"using model {model.name} for comparison")
 
-        if await compare(session, model, comparison2, verbose):
+        if await compare(session, model, comparison2, trail, verbose, pair=(get_model(0).name, get_model(2).name)):
           if verbose: display(trail, f"comparison {model.name} succeeds, can use {get_model(0).name}")
+          set_quorum([get_model(0).name, get_model(2).name])
           return alice
         else:
           if two_way_only:
@@ -202,12 +586,44 @@ async def compare_two_or_three_way(prompt, texts, two_way_only, trail, verbose =
             model = get_comparison_model(2)
           if verbose: display(trail, f"using model {model.name} for comparison")
 
-          if await compare(session, model, comparison3, verbose):
+          if await compare(session, model, comparison3, trail, verbose, pair=(get_model(1).name, get_model(2).name)):
             if verbose: display(trail, f"comparison {model.name} succeeds, can use {get_model(1).name}")
+            set_quorum([get_model(1).name, get_model(2).name])
             return bob
 
     return None
 
+async def compare_two_or_three_way_speculatively(prompt, texts, two_way_only, trail, verbose = False):
+  """compare_two_or_three_way with the comparisons overlapping (see compare_speculatively)"""
+  alice = texts[0]
+  bob = texts[1]
+  eve = texts[2]
+
+  pairs = [(0, "Alice", alice, 1, "Bob", bob), (0, "Alice", alice, 2, "Eve", eve)]
+  if not two_way_only:
+    pairs.append((1, "Bob", bob, 2, "Eve", eve))
+
+  comparisons = []
+  for i1, label1, text1, i2, label2, text2 in pairs:
+    comparison = make_comparison(prompt, label1, text1, label2, text2)
+    if debug: display(trail, comparison)
+    if get_diff_comparator():
+      model = get_diff_comparison_model(get_model(i1), get_model(i2))
+    else:
+      model = get_comparison_model(len(comparisons))
+    if verbose: display(trail, f"using model {model.name} for comparison {label1} and {label2}")
+    comparisons.append((model, comparison, (get_model(i1).name, get_model(i2).name)))
+
+  async with getSession() as session:
+    decided = await compare_speculatively(session, comparisons, trail, verbose)
+
+  if decided is None:
+    return None
+  winner = pairs[decided][0]
+  if verbose: display(trail, f"comparison {comparisons[decided][0].name} succeeds, can use {get_model(winner).name}")
+  set_quorum(comparisons[decided][2])
+  return texts[winner]
+
 async def compare_all_three(prompt, texts, trail, verbose=False):
   """Compare the first 3 result texts in parallel"""
   ensure_texts(texts, 3, trail)
@@ -216,52 +632,54 @@ async def compare_all_three(prompt, texts, trail, verbose=False):
   bob = texts[1]
   eve = texts[2]
 
-  comparison1 = make_comparison(prompt, "Alice", alice, "Bob", bob)
-  if debug:
-    display(trail, "Alice and Bob")
-    display(trail, comparison1)
-
-  comparison2 = make_comparison(prompt, "Alice", alice, "Eve", eve)
-  if debug:
-    display(trail, "Alice and Eve")
-    display(trail, comparison2)
-  
-  comparison3 = make_comparison(prompt, "Bob", bob, "Eve", eve)
-  if debug:
-    display(trail, "Bob and Eve")
-    display(trail, comparison3)
- 
+  names = [(get_model(0).name, get_model(1).name), (get_model(0).name, get_model(2).name), (get_model(1).name, get_model(2).name)]
   async with getSession() as session:
-    promises = []
+    comparators = []
    
     if get_diff_comparator():
       model = get_diff_comparison_model(get_model(0), get_model(1))
     else:
       model = get_comparison_model(0)
     if verbose: display(trail, f"using model {model.name} for comparison 0")
-
-    promise = compare(session, model, comparison1, verbose)
-    promises.append(promise)
+    comparators.append(model)
 
     if get_diff_comparator():
       model = get_diff_comparison_model(get_model(0), get_model(2))
     else:
       model = get_comparison_model(1)
     if verbose: display(trail, f"using model {model.name} for comparison 1")
-
-    promise = compare(session, model, comparison2, verbose)
-    promises.append(promise)
+    comparators.append(model)
 
     if get_diff_comparator():
       model = get_diff_comparison_model(get_model(1), get_model(2))
     else:
       model = get_comparison_model(2)
     if verbose: display(trail, f"using model {model.name} for comparison 2")
+    comparators.append(model)
 
-    promise = compare(session, model, comparison3, verbose)
-    promises.append(promise)
+    if batch_comparisons:
+      pairs = [("Alice", alice, "Bob", bob), ("Alice", alice, "Eve", eve), ("Bob", bob, "Eve", eve)]
+      responses = await compare_batched(session, prompt, pairs, comparators, trail, verbose, names)
+    else:
+      comparison1 = make_comparison(prompt, "Alice", alice, "Bob", bob)
+      if debug:
+        display(trail, "Alice and Bob")
+        display(trail, comparison1)
 
-    responses = await asyncio.gather(*promises)
+      comparison2 = make_comparison(prompt, "Alice", alice, "Eve", eve)
+      if debug:
+        display(trail, "Alice and Eve")
+        display(trail, comparison2)
+
+      comparison3 = make_comparison(prompt, "Bob", bob, "Eve", eve)
+      if debug:
+        display(trail, "Bob and Eve")
+        display(trail, comparison3)
+
+      promises = []
+      for comparator, comparison, pair in zip(comparators, [comparison1, comparison2, comparison3], names):
+        promises.append(compare(session, comparator, comparison, trail, verbose, pair=pair))
+      responses = await asyncio.gather(*promises)
 
   if verbose:
     display(trail, "Alice and Bob " +  ("agree" if responses[0] else "fail to agree"))
@@ -271,11 +689,12 @@ async def compare_all_three(prompt, texts, trail, verbose=False):
   if all(responses):
     display(trail, "**concensus**")
 
-  if responses[0]:
-    return alice
-  if responses[1]:
+  if responses[0] or responses[1]:
+    set_quorum([name for name, agreed in zip([get_model(0).name, get_model(1).name, get_model(2).name],
+                                             [True, responses[0], responses[1]]) if agreed])
     return alice
   if responses[2]:
+    set_quorum(names[2])
     return bob
   
   return None
@@ -296,29 +715,19 @@ async def compare_two_first(prompt, texts, trail, verbose=False):
     else:
       model = get_comparison_model(0)
     if verbose: display(trail, "Compare first two responses using " + model.name)
-    response = await compare(session, model, comparison1, verbose)
+    response = await compare(session, model, comparison1, trail, verbose, pair=(get_model(0).name, get_model(1).name))
     if response:
       display(trail, f"first two models agree, can use {get_model(0).name}")
+      set_quorum([get_model(0).name, get_model(1).name])
       return alice
     
     # Get 3rd model text
-    i = 0
-    text3 = ""
-    
-    for model in models:
-      if schedule[model.name]:
-        if i == 2:
-          if debug: display(trail, "query next model " + model.name)
-          model3 = model
-          response = await model.ask(session, model.make_query(prompt))
-          if response is not None and response.strip() != "":
-            json_data = json.loads(response)
-            text3 = support.search_json(json_data, model.text_field)
-          else:
-            text3 = ""
-          break
-        else:
-          i += 1
+    if over_budget():
+      display(trail, "budget used up, not querying a third model")
+      return None
+    model3 = get_model(2)
+    if debug: display(trail, "query next model " + model3.name)
+    text3 = await query_model(session, model3, prompt, trail)
 
     if text3 == "":
       display(trail, f"3rd model {model3.name} failed to answer!")
@@ -336,9 +745,10 @@ async def compare_two_first(prompt, texts, trail, verbose=False):
     else:
       model = get_comparison_model(1)
     if verbose: display(trail, "Compare first and third using " + model.name)
-    response = await compare(session, model, comparison2, verbose)
+    response = await compare(session, model, comparison2, trail, verbose, pair=(get_model(0).name, model3.name))
     if response:
       display(trail, f"first and third agree, can use {get_model(0).name}")
+      set_quorum([get_model(0).name, model3.name])
       return alice
   
     comparison3 = make_comparison(prompt, "Bob", bob, "Eve", eve)
@@ -349,24 +759,18 @@ async def compare_two_first(prompt, texts, trail, verbose=False):
     else:
       model = get_comparison_model(2)
     if verbose: display(trail, "Compare second and third using " + model.name)
-    response = await compare(session, model, comparison3, verbose)
+    response = await compare(session, model, comparison3, trail, verbose, pair=(get_model(1).name, model3.name))
     if response:
       display(trail, f"second and third agree, can use {get_model(1).name}")
-    return bob
+      set_quorum([get_model(1).name, model3.name])
+      return bob
   
   display(trail, "none agree")
   return None
 
 def n_ways(trail, verbose=False):
-  m = []
+  m = scheduled_models()[:max_no_models]
   pairs = []
-  max = max_no_models
-  for model in models:
-    if max == 0:
-      break
-    if schedule[model.name]:
-      m.append(model)
-      max -= 1
   for i in range(len(m) - 1):
     for j in range(i + 1, len(m)):
       if verbose: display(trail, m[i].name + " <-> " + m[j].name)
@@ -374,21 +778,25 @@ def n_ways(trail, verbose=False):
   return pairs
 
 
+batch_names = ["Alice", "Bob", "Eve", "John", "Jane"]
+
+def batch_label(run_models, model):
+  i = run_models.index(model)
+  name = batch_names[i] if i < len(batch_names) else "Answerer " + str(i + 1)
+  return name + " (using " + model.name + ")"
+
 async def compare_n_way(prompt, response_texts, trail, verbose=False):
   run_models = []
   comp_models = []
   response_map = {}
   r = 0
-  for model in models:
-    if r == max_no_models:
-      break
-    if schedule[model.name]:
-      if debug:
-        print("response from " + model.name)
-        print(response_texts[r])
-      run_models.append(model)
-      response_map[model.name] = response_texts[r]
-      r += 1
+  for model in scheduled_models()[:max_no_models]:
+    if debug:
+      print("response from " + model.name)
+      print(response_texts[r])
+    run_models.append(model)
+    response_map[model.name] = response_texts[r]
+    r += 1
   
   quorums = {}
   promises = []
@@ -397,21 +805,30 @@ async def compare_n_way(prompt, response_texts, trail, verbose=False):
   async with getSession() as session:
 
     for comparison_pair in comparison_pairs:
-      comparison = make_comparison(prompt, 
-                                   "John (using " + comparison_pair[0].name + ")",
-                                   response_map[comparison_pair[0].name],
-                                   "Jane (using " + comparison_pair[1].name + ")",
-                                   response_map[comparison_pair[1].name])
-      if debug: display(trail, comparison)
- 
       comparison_model = get_diff_comparison_model(comparison_pair[0], comparison_pair[1])
       if debug: display(trail, "comparison model selected: " + comparison_model.name)
       comp_models.append(comparison_model)
 
-      promise = compare(session, comparison_model, comparison, verbose)
-      promises.append(promise)
+      if not batch_comparisons: # (batched pairs are put together by compare_batched)
+        comparison = make_comparison(prompt, 
+                                     "John (using " + comparison_pair[0].name + ")",
+                                     response_map[comparison_pair[0].name],
+                                     "Jane (using " + comparison_pair[1].name + ")",
+                                     response_map[comparison_pair[1].name])
+        if debug: display(trail, comparison)
+        promise = compare(session, comparison_model, comparison, trail, verbose,
+                          pair=(comparison_pair[0].name, comparison_pair[1].name))
+        promises.append(promise)
 
-    responses = await asyncio.gather(*promises)
+    if batch_comparisons:
+      pairs = []
+      for model1, model2, compare_result in comparison_pairs:
+        pairs.append((batch_label(run_models, model1), response_map[model1.name],
+                      batch_label(run_models, model2), response_map[model2.name]))
+      names = [(model1.name, model2.name) for model1, model2, compare_result in comparison_pairs]
+      responses = await compare_batched(session, prompt, pairs, comp_models, trail, verbose, names)
+    else:
+      responses = await asyncio.gather(*promises)
 
   r = 0
   # go over the comparison results and add into quorums
@@ -447,6 +864,7 @@ async def compare_n_way(prompt, response_texts, trail, verbose=False):
   else:
     if verbose: display(trail, "quorum " + quorum + " of " + str(quorum_size))
     q = quorums[quorum]
+    set_quorum([quorum] + q)
     if verbose: display(trail, quorum)
     for model_name in q:
       if verbose: display(trail, model_name)
@@ -462,6 +880,77 @@ async def compare_n_way(prompt, response_texts, trail, verbose=False):
   return None
 
 
+async def compare_quorum(prompt, texts, k, trail, verbose=False):
+  """Compare the first k result texts and bring in further scheduled models only until k agree"""
+  run_models = scheduled_models()
+
+  answered = []
+  for i in range(min(len(texts), len(run_models))):
+    answered.append((run_models[i], texts[i]))
+
+  quorums = {}
+  compared = 0
+  c = 0
+  async with getSession() as session:
+    while True:
+      # compare every new response with those already answered
+      pairs = []
+      for j in range(compared, len(answered)):
+        for i in range(j):
+          pairs.append((answered[i], answered[j]))
+      compared = len(answered)
+
+      promises = []
+      for (model1, text1), (model2, text2) in pairs:
+        comparison = make_comparison(prompt, 
+                                     "John (using " + model1.name + ")", text1,
+                                     "Jane (using " + model2.name + ")", text2)
+        if debug: display(trail, comparison)
+        if get_diff_comparator():
+          comparison_model = get_diff_comparison_model(model1, model2)
+        else:
+          comparison_model = get_comparison_model(c)
+          c += 1
+        promises.append(compare(session, comparison_model, comparison, trail, verbose, pair=(model1.name, model2.name)))
+
+      responses = await asyncio.gather(*promises)
+
+      for r in range(len(pairs)):
+        model1 = pairs[r][0][0]
+        model2 = pairs[r][1][0]
+        if verbose: display(trail, "comparison " + model1.name + " <--> " + model2.name + " " + ("agree" if responses[r] else "fail to agree"))
+        if responses[r]:
+          quorums.setdefault(model1.name, []).append(model2.name)
+          quorums.setdefault(model2.name, []).append(model1.name)
+
+      # the first model with k - 1 others agreeing wins
+      for model, text in answered:
+        q = quorums.get(model.name)
+        if q is not None and len(q) + 1 >= k:
+          if verbose: display(trail, "quorum " + model.name + " of " + str(len(q) + 1) + " using " + str(len(answered)) + " models")
+          set_quorum([model.name] + q)
+          return text
+
+      if len(answered) == len(run_models):
+        if verbose: display(trail, "No quorum of " + str(k) + " found.")
+        return None
+
+      # bring in the next models
+      if over_budget():
+        display(trail, "budget used up, not querying further models")
+        return None
+      next_models = run_models[len(answered):len(answered) + quorum_batch_size]
+      next_texts = await asyncio.gather(*[query_model(session, model, prompt, trail) for model in next_models])
+      for i in range(len(next_models)):
+        model = next_models[i]
+        if next_texts[i] == "":
+          display(trail, f"model {model.name} failed to answer!")
+        else:
+          display(trail, "model " + model.name)
+          display(trail, next_texts[i])
+        answered.append((model, next_texts[i]))
+
+
 # new comarison - add using following template here
 async def compare_new_template(prompt, texts, trail, verbose=False):
   """ new comparison template """
@@ -471,7 +960,7 @@ async def compare_new_template(prompt, texts, trail, verbose=False):
   async with getSession() as session:
     promises = []
     # comparison = make_comparison(prompt, "Alice", texts[0], "Bob", texts[1])
-    # promise = compare(session, comparison_model, comparison, verbose)
+    # promise = compare(session, comparison_model, comparison, trail, verbose)
     # promises.append(promise)
 
     # responses = await asyncio.gather(*promises)
@@ -482,7 +971,62 @@ async def compare_new_template(prompt, texts, trail, verbose=False):
   return None
 
 
-async def run_comparison(prompt, action):
+run_store = None
+
+def get_run_store():
+  global run_store
+  if run_store is None or run_store.path != run_store_file:
+    run_store = RunStore(run_store_file)
+  return run_store
+
+async def run_comparison(prompt, action, budget=None):
+  trail, usage = await run_comparison_with_usage(prompt, action, budget)
+  return trail
+
+def cache_scope(action):
+  """What a cached answer depends on besides the prompt: the action, the models and comparators and how they compare"""
+  answerers = sorted(model.name + "=" + model.model for model in models if schedule[model.name])
+  comparators = sorted(cm.name + "=" + cm.model for cm in comparison_models if comparison_schedule[cm.name])
+  return "|".join([action, ",".join(answerers), ",".join(comparators), str(get_diff_comparator()), str(verdict_mode)])
+
+async def run_comparison_with_usage(prompt, action, budget=None):
+  """Run a comparison returning the trail and the tokens and cost used per phase.
+     budget (dollars) overrides the configured max_cost_per_request."""
+  if semantic_cache:
+    cached = semcache.cache.lookup(prompt, cache_scope(action))
+    if cached is not None:
+      trail = []
+      display(trail, f"semantic cache hit (similarity {cached['similarity']:.2f}) for prompt: {cached['prompt']}")
+      display(trail, cached["verdict"])
+      display(trail, cached["answer"])
+      return trail, costs.summarize([])
+
+  state = { "order": make_schedule_order(), "answers": {}, "calls": [],
+            "budget": budget if budget is not None else get_max_cost_per_request() }
+  token = run_state.set(state)
+  try:
+    trail = await run_compare_action(prompt, action)
+  finally:
+    run_state.reset(token)
+
+  # only compared answers are kept (not failures that may be an outage)
+  if semantic_cache and len(trail) >= 2 and trail[-2] == "PASS compared response" and trail[-1].strip() != "":
+    semcache.cache.add(prompt, cache_scope(action), trail[-2], trail[-1])
+
+  compared_text = trail[-1] if trail[-2] == "PASS compared response" else None
+  winners = state.get("quorum", []) if compared_text is not None else [] # the models agreeing on the answer
+  if adaptive_selection:
+    selector.record_run(list(state["answers"].keys()), winners)
+    selector.save()
+  if record_runs:
+    result = "NONE" if trail[-2] == "first response:" else "PASS" if compared_text is not None else "FAIL"
+    get_run_store().add(prompt, action, result, winners, state["calls"])
+
+  usage = costs.summarize(state["calls"])
+  usage["budget_exceeded"] = state.get("budget_exceeded", False)
+  return trail, usage
+
+async def run_compare_action(prompt, action):
   trail = []
 
   # new comparison - constrain the fan out here
@@ -490,12 +1034,19 @@ async def run_comparison(prompt, action):
     max_models = 2
   elif action in ["2-way", "3-way", "3-all"]:
     max_models = 3
+  elif action.startswith("quorum-") and action[7:].isdigit() and int(action[7:]) >= 2:
+    max_models = int(action[7:])
   else:
     max_models = max_no_models
 
   responses = await multi_way_query(prompt, max_models)
 
   texts = parse_responses(responses, trail, True)
+  del responses # only the texts are needed from here on
+
+  if condense_responses is not None and action != "none":
+    async with getSession() as session:
+      await condense_texts(session, texts, trail)
 
   compared_text = None
 
@@ -512,7 +1063,10 @@ async def run_comparison(prompt, action):
     compared_text = await compare_all_three(prompt, texts, trail, True)
   elif action == "n-way":
     compared_text = await compare_n_way(prompt, texts, trail, True)
+  elif action.startswith("quorum-") and action[7:].isdigit() and int(action[7:]) >= 2:
+    compared_text = await compare_quorum(prompt, texts, int(action[7:]), trail, True)
   elif action == "none":
+    display_run(trail)
     display(trail, "first response:")
     display(trail, texts[0])
     return trail
@@ -521,6 +1075,8 @@ async def run_comparison(prompt, action):
     display(trail, "unknown compare action " + action)
     return trail
 
+  display_run(trail)
+
   if compared_text is not None:
     display(trail, "PASS compared response")
     display(trail, compared_text)
@@ -530,6 +1086,87 @@ async def run_comparison(prompt, action):
 
   return trail
 
+def display_run(trail):
+  """Show the calls made and the tokens and cost used (if configured) before the result"""
+  state = get_run_state()
+  if show_calls: display_calls(state["calls"], trail)
+  if show_usage:
+    for line in costs.describe(costs.summarize(state["calls"])):
+      display(trail, line)
+  if state.get("budget_exceeded"):
+    display(trail, f"budget of ${state['budget']} used up")
+
+async def read_lines(file):
+  """The lines of a file (stdin or a pipe) as they arrive without blocking the event loop"""
+  loop = asyncio.get_running_loop()
+  queue = asyncio.Queue()
+
+  def read():
+    try:
+      for line in file:
+        loop.call_soon_threadsafe(queue.put_nowait, line)
+    finally:
+      loop.call_soon_threadsafe(queue.put_nowait, None)
+
+  threading.Thread(target=read, daemon=True).start()
+  while True:
+    line = await queue.get()
+    if line is None:
+      return
+    yield line
+
+async def run_pipe(action, input, output, max_in_flight=None, ordered=None):
+  """Run a comparison for each prompt line of input as it arrives, up to max_in_flight at once, writing a JSON line
+     per prompt (with its index, the input line, compared response, trail, usage and seconds taken) to output in input order
+     or as they finish (default config pipe_max_in_flight and pipe_ordered).
+     Runs waiting to be written in order count towards max_in_flight."""
+  if ordered is None:
+    ordered = pipe_ordered
+  slots = asyncio.Semaphore(max_in_flight or pipe_max_in_flight)
+  results = {}
+  next_index = 0
+  tasks = set()
+
+  def write(result):
+    output.write(json.dumps(result) + "\n")
+    output.flush()
+
+  def flush():
+    nonlocal next_index
+    while next_index in results:
+      write(results.pop(next_index))
+      next_index += 1
+      slots.release()
+
+  async def run(index, line, prompt):
+    start = time.time()
+    try:
+      trail, usage = await run_comparison_with_usage(prompt, action)
+      result = { "index": index, "prompt": line, "action": action, "compared_response": trail[-1],
+                 "trail": trail, "usage": usage }
+    except Exception as e:
+      result = { "index": index, "prompt": line, "action": action, "error": f"{e.__class__.__name__}: {e}" }
+    result["seconds"] = round(time.time() - start, 3)
+    if ordered:
+      results[index] = result
+      flush()
+    else:
+      write(result)
+      slots.release()
+
+  index = 0
+  async for line in read_lines(input):
+    line = line.rstrip("\r\n") # the prompt as given is written back to join the results with the input
+    prompt = clean(line.strip())
+    if prompt == "":
+      continue
+    await slots.acquire()
+    task = asyncio.create_task(run(index, line, prompt))
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    index += 1
+  await asyncio.gather(*tasks)
+
 async def timed_comparison(prompt, action):
   start_time = time.time()
 
@@ -539,15 +1176,23 @@ async def timed_comparison(prompt, action):
   print(f"Time taken: {end_time - start_time:.2f} seconds")
 
 async def main():
+  global show_calls, show_usage
   set_trail_only(False)
 
+  if "--calls" in sys.argv:
+    sys.argv.remove("--calls")
+    show_calls = True
+  if "--usage" in sys.argv:
+    sys.argv.remove("--usage")
+    show_usage = True
+
   if len(sys.argv) > 2:
     action = sys.argv[1]
     prompt = clean(sys.argv[2])
   else:
     print(
        # new comarison - add here
-"""Usage: python3 multillm.py 3-way|2-way|1-way|none|2-1|3-all|n-way prompt
+"""Usage: python3 multillm.py 3-way|2-way|1-way|none|2-1|3-all|n-way|quorum-k prompt
           -- use given text as a prompt for multiple models and perform a comparison.
              1-way compare two responses
              2-way compare first response with second and third response
@@ -555,6 +1200,7 @@ async def main():
              2-1 compare 2 responses and go on to a third only if first two fail to agree
              3-all compare three responses all ways
              n-way compare all the responses each way
+             quorum-k compare k responses and query further models only until k agree (e.g. quorum-3)
              none can be used to just query and not do a comparison
 
           python3 multillm.py xyz input
@@ -562,14 +1208,41 @@ async def main():
 
           python3 multillm.py xyz interactive
           --- start an interactive loop to read prompts. You can end this using Crtl-C or by typing "bye"
+
+          python3 multillm.py xyz pipe [unordered]
+          --- read prompts line by line from stdin as they arrive and run several at once, writing a JSON line
+              per prompt in input order (or as they finish) to stdout
+
+          Add --calls to show the calls made with their timing and transport statistics in the trail
+          and --usage to show the tokens and cost used per phase
           """)
     exit()
 
   configure()
 
+  if prompt == "pipe":
+    set_trail_only(True)
+    output = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr): # progress messages stay out of the results
+      if warm_up:
+        await warm_up_connections()
+      warmer = asyncio.create_task(keep_warm()) if warm_up else None
+      ordered = pipe_ordered and not (len(sys.argv) > 3 and sys.argv[3] == "unordered")
+      await run_pipe(action, sys.stdin, output, ordered=ordered)
+      if warmer is not None: warmer.cancel()
+      await close_connections()
+    return
+
+  if warm_up:
+    await warm_up_connections()
+
   if prompt == "interactive": 
+    warmer = asyncio.create_task(keep_warm()) if warm_up else None
     while True:
-      prompt = input("prompt>")
+      try:
+        prompt = await read_line("prompt>")
+      except EOFError:
+        break
       p = prompt.strip()
       if p == "":
         continue
@@ -577,12 +1250,15 @@ async def main():
         break
       
       await timed_comparison(prompt, action)
+    if warmer is not None: warmer.cancel()
+    await close_connections()
     return
   
   if prompt == "input":
     prompt = sys.stdin.read()
   
   await timed_comparison(prompt, action)
+  await close_connections()
 
 if __name__ == "__main__":
   asyncio.run(main())
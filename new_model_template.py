@@ -1,7 +1,8 @@
 import support
+import keypool
 
-# Add a api key file for model (if required)
-api_key = support.read_file_as_string("new-model-api-key").strip()
+# Add a api key file for model (if required), one key per line
+api_keys = keypool.read_pool("new-model-api-key")
 
 # Add a url for the new model
 url = "https://"
@@ -11,21 +12,29 @@ class NewModel(support.Model):
   name = "new-model" 
   model = "new-model-version-string"
   text_field = "json-field-text-or-content-name"
+  host = "https://" # scheme and host of url (used to warm up connections)
   
   def make_query(text):
     # you may be able to use openai queries:
     # return support.make_openai_std_query(text, NewModel.model)
     return ""
 
+  def make_verdict_query(text):
+    # a query for a comparison verdict: a tiny output budget (support.verdict_max_tokens), temperature 0
+    # and any constraints the API supports. You may be able to use:
+    # return support.make_openai_verdict_query(text, NewModel.model)
+    return ""
+
   async def ask(session, query):
-    # Add headers as needed (note: this example uses standard "bearer" authentication)
-    headers = {
-     "Content-Type": "application/json",
-     "Authorization": "Bearer " + api_key
-    }
-    # You will probably be able to use the ask method from support module:
-    # return await support.ask(url, session, query, headers)
+    # Lease a key from the pool and add headers as needed (note: this example uses standard "bearer" authentication)
+    with api_keys.lease() as lease:
+      headers = {
+       "Content-Type": "application/json",
+       "Authorization": "Bearer " + lease.key
+      }
+      # You will probably be able to use the ask method from support module:
+      # return lease.done(await support.ask(url, session, query, headers))
 
-    return "{ \"error\": \"TO DO ADD MODEL IMPL\"}"
+      return "{ \"error\": \"TO DO ADD MODEL IMPL\"}"
 
   
\ No newline at end of file
@@ -1,6 +1,8 @@
 import support 
+import keypool
 
-openai_api_key = support.read_file_as_string("openai-api-key").strip()
+openai_keys = keypool.read_pool("openai-api-key")
+openai_api_key = openai_keys.first() # for batch jobs
 
 url = "https://api.openai.com/v1/chat/completions"
 
@@ -8,16 +10,22 @@ class Openai(support.Model):
   name = "openai"
   model = "gpt-4o"
   text_field = "content"
+  host = "https://api.openai.com"
+  batch_api = "openai"
  
   def make_query(text):
     return support.make_openai_std_query(text, Openai.model)
 
+  def make_verdict_query(text):
+    return support.make_openai_verdict_query(text, Openai.model)
+
   async def ask(session, query):
-    headers = {
-      "Content-Type": "application/json",
-      "Authorization": "Bearer " + openai_api_key
-    }
-    return await support.ask(url, session, query, headers)
+    with openai_keys.lease() as lease:
+      headers = {
+        "Content-Type": "application/json",
+        "Authorization": "Bearer " + lease.key
+      }
+      return lease.done(await support.ask(url, session, query, headers))
 
 # Example of a second model from a vendor
 class Openai2(Openai):
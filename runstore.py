@@ -0,0 +1,181 @@
+import math
+import time
+import uuid
+import sqlite3
+import argparse
+from contextlib import closing
+
+# A local history of runs (sqlite) with every query and comparison call made: model, version, phase, latency,
+# status, response size, tokens, cost and the verdicts of comparisons. The report works out per model latency
+# percentiles and error rates, how often each pair of models agree and how often each comparator decided the result,
+# to see which models are worth keeping for speed and cost.
+#
+#   python3 runstore.py report [--file runs.db] [--days 7] [--action 3-way]
+
+class RunStore:
+
+  def __init__(self, path="runs.db"):
+    self.path = path
+    with closing(self.connect()) as db:
+      db.execute("PRAGMA journal_mode=WAL")
+      db.execute("""CREATE TABLE IF NOT EXISTS runs (
+                      id TEXT PRIMARY KEY,
+                      time REAL NOT NULL,
+                      action TEXT NOT NULL,
+                      result TEXT NOT NULL,
+                      winners TEXT NOT NULL,
+                      prompt_chars INTEGER NOT NULL)""")
+      db.execute("""CREATE TABLE IF NOT EXISTS calls (
+                      run_id TEXT NOT NULL,
+                      model TEXT NOT NULL,
+                      version TEXT,
+                      phase TEXT NOT NULL,
+                      ms REAL,
+                      ok INTEGER NOT NULL,
+                      status INTEGER,
+                      response_size INTEGER,
+                      input_tokens INTEGER,
+                      output_tokens INTEGER,
+                      cost REAL)""")
+      db.execute("""CREATE TABLE IF NOT EXISTS verdicts (
+                      run_id TEXT NOT NULL,
+                      comparator TEXT NOT NULL,
+                      model1 TEXT NOT NULL,
+                      model2 TEXT NOT NULL,
+                      agree INTEGER NOT NULL)""")
+      db.execute("CREATE INDEX IF NOT EXISTS runs_time ON runs (time)")
+      db.execute("CREATE INDEX IF NOT EXISTS calls_run ON calls (run_id)")
+      db.execute("CREATE INDEX IF NOT EXISTS verdicts_run ON verdicts (run_id)")
+
+  def connect(self):
+    return sqlite3.connect(self.path, timeout=30)
+
+  def add(self, prompt, action, result, winners, calls):
+    """Append a run (result PASS, FAIL or NONE, the names of the models whose answer was used) and its calls"""
+    id = uuid.uuid4().hex
+    with closing(self.connect()) as db, db:
+      db.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?)",
+                 (id, time.time(), action, result, ",".join(winners), len(prompt)))
+      db.executemany("INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     [(id, call["model"], call.get("version"), call["phase"], call.get("ms"), call["ok"], call.get("status"),
+                       call.get("response_size"), call.get("input_tokens"), call.get("output_tokens"), call.get("cost"))
+                      for call in calls])
+      db.executemany("INSERT INTO verdicts VALUES (?, ?, ?, ?, ?)",
+                     [(id, call["model"], model1, model2, agree)
+                      for call in calls for model1, model2, agree in call.get("verdicts", [])])
+    return id
+
+  def select(self, sql, since, action):
+    """Rows of a query on the runs (joined as r) since a time and of an action (None for all)"""
+    where = " AND r.time >= ?" + ("" if action is None else " AND r.action = ?")
+    params = (since,) if action is None else (since, action)
+    with closing(self.connect()) as db:
+      return db.execute(sql.replace("{where}", where), params).fetchall()
+
+def percentile(values, p):
+  """Nearest rank percentile of sorted values"""
+  if len(values) == 0:
+    return None
+  return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+def latency_report(store, since, action):
+  rows = store.select("SELECT c.model, c.version, c.phase, c.ms, c.ok, c.cost FROM calls c JOIN runs r ON r.id = c.run_id" +
+                      " WHERE 1 = 1 {where}", since, action)
+  groups = {}
+  for model, version, phase, ms, ok, cost in rows:
+    group = groups.setdefault((model, version, phase), { "ms": [], "calls": 0, "errors": 0, "cost": 0.0 })
+    group["calls"] += 1
+    if not ok:
+      group["errors"] += 1
+    elif ms is not None and ms > 0:
+      group["ms"].append(ms)
+    group["cost"] += cost or 0
+
+  lines = [f"{'model':12} {'version':28} {'phase':10} {'calls':>6} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'cost $':>9}"]
+  for (model, version, phase), group in sorted(groups.items()):
+    ms = sorted(group["ms"])
+    p = [percentile(ms, q) for q in [50, 95, 99]]
+    lines.append(f"{model:12} {str(version):28} {phase:10} {group['calls']:6} {group['errors'] / group['calls']:7.1%} " +
+                 " ".join("       -" if v is None else f"{v:8.0f}" for v in p) + f" {group['cost']:9.4f}")
+  return lines
+
+def agreement_report(store, since, action):
+  rows = store.select("SELECT v.model1, v.model2, SUM(v.agree), COUNT(*) FROM verdicts v JOIN runs r ON r.id = v.run_id" +
+                      " WHERE 1 = 1 {where} GROUP BY v.model1, v.model2", since, action)
+  agree = {}
+  models = set()
+  for model1, model2, agreed, count in rows:
+    for key in [(model1, model2), (model2, model1)]:
+      a, c = agree.get(key, (0, 0))
+      agree[key] = (a + agreed, c + count)
+    models.update([model1, model2])
+  models = sorted(models)
+
+  lines = ["agreement (share of comparisons saying YES, comparisons)", " " * 12 + "".join(f"{m[:12]:>14}" for m in models)]
+  for m1 in models:
+    cells = []
+    for m2 in models:
+      if (m1, m2) in agree:
+        a, c = agree[(m1, m2)]
+        cells.append(f"{a / c:8.0%} ({c:3})")
+      else:
+        cells.append(" " * 14)
+    lines.append(f"{m1[:12]:12}" + "".join(cells))
+  return lines
+
+def comparator_report(store, since, action):
+  """How often the verdict of each comparator decided the result: a YES on a pair including a winning model
+     of a passed run or a NO in a failed run. Sole when it was the only deciding verdict of the run."""
+  rows = store.select("SELECT r.id, r.result, r.winners, v.comparator, v.model1, v.model2, v.agree" +
+                      " FROM verdicts v JOIN runs r ON r.id = v.run_id WHERE 1 = 1 {where}", since, action)
+  runs = {}
+  for id, result, winners, comparator, model1, model2, agree in rows:
+    winners = winners.split(",") if winners != "" else []
+    deciding = (result == "PASS" and agree and (model1 in winners or model2 in winners)) or (result == "FAIL" and not agree)
+    runs.setdefault(id, []).append((comparator, agree, deciding))
+
+  stats = {}
+  for verdicts in runs.values():
+    deciding = [comparator for comparator, agree, d in verdicts if d]
+    for comparator, agree, d in verdicts:
+      s = stats.setdefault(comparator, { "verdicts": 0, "yes": 0, "deciding": 0, "sole": 0 })
+      s["verdicts"] += 1
+      s["yes"] += 1 if agree else 0
+      s["deciding"] += 1 if d else 0
+      s["sole"] += 1 if d and len(deciding) == 1 else 0
+
+  lines = [f"{'comparator':12} {'verdicts':>9} {'yes':>7} {'deciding':>9} {'sole':>7}"]
+  for comparator, s in sorted(stats.items()):
+    lines.append(f"{comparator:12} {s['verdicts']:9} {s['yes'] / s['verdicts']:7.0%} {s['deciding'] / s['verdicts']:9.0%}" +
+                 f" {s['sole'] / s['verdicts']:7.0%}")
+  return lines
+
+def runs_report(store, since, action):
+  rows = store.select("SELECT r.action, r.result, COUNT(*) FROM runs r WHERE 1 = 1 {where} GROUP BY r.action, r.result",
+                      since, action)
+  lines = ["runs"]
+  for action, result, count in sorted(rows):
+    lines.append(f"  {action:10} {result:5} {count}")
+  return lines
+
+def report(store, days=None, action=None):
+  since = 0 if days is None else time.time() - days * 24 * 3600
+  lines = []
+  for part in [runs_report, latency_report, agreement_report, comparator_report]:
+    lines += part(store, since, action) + [""]
+  return "\n".join(lines)
+
+def main():
+  parser = argparse.ArgumentParser(description="Report on the runs kept in the run store")
+  parser.add_argument("command", choices=["report"])
+  parser.add_argument("--file", default=None, help="run store (default config run_store_file)")
+  parser.add_argument("--days", type=float, default=None, help="only runs in the last days")
+  parser.add_argument("--action", default=None, help="only runs of the comparison action")
+  args = parser.parse_args()
+  if args.file is None:
+    from config import run_store_file
+    args.file = run_store_file
+  print(report(RunStore(args.file), args.days, args.action))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,161 @@
+import json
+import os
+import time
+import atexit
+import random
+import threading
+try:
+  import fcntl
+except ImportError: # (not on Windows, saves are then only serialised within a process)
+  fcntl = None
+
+# Adaptive ordering of models and comparators from rolling statistics kept between runs.
+# Each model keeps a window of recent latencies, its error count and how often its answer won.
+# Models with too few samples are tried first (in static order) so every scheduled model gets measured,
+# after that the order is by expected latency penalised by errors and (for answers) rewarded by wins.
+# With probability exploration the static order is used so that slow starters can recover.
+# The statistics are shared by the threads of a process and by processes (Web app, job workers) through the stats file:
+# every save_interval_seconds (and at exit) the counts recorded since the last save are merged into the file
+# under a file lock and written to a temporary file that replaces it.
+
+window = 50
+min_samples = 3
+error_penalty = 4.0
+
+stats = None
+stats_file = None
+exploration = 0.1
+save_interval_seconds = 10
+
+deltas = {} # name -> what was recorded since the last save
+last_save = 0
+lock = threading.RLock()
+
+def configure(filepath, explore, save_seconds=10):
+  global stats_file, exploration, stats, deltas, save_interval_seconds
+  with lock:
+    if filepath != stats_file:
+      stats = None
+      deltas = {}
+    stats_file = filepath
+    exploration = explore
+    save_interval_seconds = save_seconds
+
+def empty():
+  return { "latencies": [], "calls": 0, "errors": 0, "runs": 0, "wins": 0 }
+
+def read_stats():
+  if stats_file is None or not os.path.isfile(stats_file):
+    return {}
+  try:
+    with open(stats_file, 'r') as file:
+      return json.load(file)
+  except Exception as e:
+    print(f"Ignoring unreadable model stats '{stats_file}': {e}")
+    return {}
+
+def load():
+  global stats
+  with lock:
+    if stats is None:
+      stats = read_stats()
+    return stats
+
+def merge(s, d):
+  for key in ["calls", "errors", "runs", "wins"]:
+    s[key] += d[key]
+  s["latencies"] = (s["latencies"] + d["latencies"])[-window:]
+
+def save(force=False):
+  """Merge what was recorded since the last save into the stats file (at most every save_interval_seconds)"""
+  global stats, deltas, last_save
+  with lock:
+    if stats_file is None or len(deltas) == 0:
+      return
+    if not force and time.time() - last_save < save_interval_seconds:
+      return
+    tmp = f"{stats_file}.{os.getpid()}.tmp"
+    try:
+      with open(stats_file + ".lock", 'w') as lock_file:
+        if fcntl is not None: fcntl.flock(lock_file, fcntl.LOCK_EX)
+        merged = read_stats()
+        for name, d in deltas.items():
+          merge(merged.setdefault(name, empty()), d)
+        with open(tmp, 'w') as file:
+          json.dump(merged, file)
+        os.replace(tmp, stats_file)
+      stats = merged # (now with what the other processes recorded)
+      deltas = {}
+    except Exception as e:
+      print(f"An error occurred while saving model stats '{stats_file}': {e}")
+    last_save = time.time()
+
+atexit.register(save, True)
+
+def get(name):
+  s = load().get(name)
+  if s is None:
+    s = load()[name] = empty()
+  return s
+
+def record(name, d):
+  """Add to the stats in memory and to those to save"""
+  with lock:
+    merge(get(name), d)
+    merge(deltas.setdefault(name, empty()), d)
+
+def record_call(name, latency, ok):
+  d = empty()
+  d["calls"] = 1
+  d["errors"] = 0 if ok else 1
+  d["latencies"] = [round(latency, 3)]
+  record(name, d)
+
+def record_run(names, winners):
+  """Count a run for each model queried and a win for those whose answer was used"""
+  for name in names:
+    d = empty()
+    d["runs"] = 1
+    d["wins"] = 1 if name in winners else 0
+    record(name, d)
+
+def percentile(values, p):
+  if len(values) == 0:
+    return None
+  values = sorted(values)
+  return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+def error_rate(name):
+  s = get(name)
+  return s["errors"] / s["calls"] if s["calls"] > 0 else 0.0
+
+def score(name, answers):
+  """Expected cost of using a model, lower is better"""
+  s = get(name)
+  cost = percentile(s["latencies"], 90) * (1 + error_penalty * error_rate(name))
+  if answers:
+    # Laplace smoothed win rate so a model that never wins is not ranked infinitely badly
+    cost /= (s["wins"] + 1) / (s["runs"] + 2) + 0.5
+  return cost
+
+def order(candidates, answers=True):
+  """Order the scheduled candidates (a list of model classes), keeping the static order as fallback"""
+  if random.random() < exploration:
+    return list(candidates)
+  unmeasured = [m for m in candidates if len(get(m.name)["latencies"]) < min_samples]
+  measured = [m for m in candidates if len(get(m.name)["latencies"]) >= min_samples]
+  measured.sort(key=lambda m: score(m.name, answers))
+  return unmeasured + measured
+
+def report():
+  lines = []
+  for name, s in load().items():
+    lines.append(f"{name}: calls {s['calls']} errors {s['errors']} p50 {percentile(s['latencies'], 50)}" + \
+                 f" p90 {percentile(s['latencies'], 90)} won {s['wins']} of {s['runs']} runs")
+  return lines
+
+if __name__ == "__main__":
+  import sys
+  configure(sys.argv[1] if len(sys.argv) > 1 else "model-stats.json", 0)
+  for line in report():
+    print(line)
@@ -0,0 +1,137 @@
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# A semantic cache of compared answers so near repeats of a prompt ("Capital of Narnia?" and
+# "what's the capital of narnia") are answered without querying the models again.
+# Prompts are normalised (lower case, no punctuation or common filler words) and split into character shingles.
+# A MinHash signature of the shingles estimates the Jaccard similarity of two prompts and locality sensitive
+# hashing (bands of the signature) finds the candidates to compare. Prompts with different numbers ("in 2020" and
+# "in 2021") never match however similar the rest is. Entries are scoped (by comparison action and the models used),
+# expire after a time to live and the least recently used are evicted when the cache is full.
+
+shingle_size = 4
+num_hashes = 64
+bands = 16
+rows = num_hashes // bands
+prime = (1 << 61) - 1
+
+stop_words = set("""a an the of what whats which who whos is are was were be to in on at for do does did
+                    please tell me i you can could would will give us our my your it its that thats""".split())
+
+def make_coefficients():
+  coefficients = []
+  for i in range(num_hashes):
+    digest = hashlib.blake2b(str(i).encode(), digest_size=16).digest()
+    a = int.from_bytes(digest[:8], "big") % (prime - 1) + 1
+    b = int.from_bytes(digest[8:], "big") % prime
+    coefficients.append((a, b))
+  return coefficients
+
+coefficients = make_coefficients()
+
+def normalize(prompt):
+  # (prompts may have been cleaned with escaped new lines)
+  words = re.findall(r"[a-z0-9]+", prompt.lower().replace("\\n", " ").replace("'", ""))
+  kept = [word for word in words if word not in stop_words]
+  return " ".join(kept if len(kept) > 0 else words)
+
+def numbers(text):
+  return re.findall(r"[0-9]+", text)
+
+def shingles(text):
+  if len(text) <= shingle_size:
+    return { text }
+  return { text[i:i + shingle_size] for i in range(len(text) - shingle_size + 1) }
+
+def signature(text):
+  hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big") for s in shingles(text)]
+  return [min((a * h + b) % prime for h in hashes) for a, b in coefficients]
+
+def similarity(signature1, signature2):
+  same = 0
+  for i in range(num_hashes):
+    if signature1[i] == signature2[i]:
+      same += 1
+  return same / num_hashes
+
+def band_keys(action, sig):
+  return [(action, band, tuple(sig[band * rows:(band + 1) * rows])) for band in range(bands)]
+
+class SemanticCache:
+
+  def __init__(self, threshold=0.9, ttl_seconds=3600, max_entries=10000):
+    self.threshold = threshold
+    self.ttl_seconds = ttl_seconds
+    self.max_entries = max_entries
+    self.entries = OrderedDict() # id -> entry, least recently used first
+    self.buckets = {}            # band key -> set of entry ids
+    self.next_id = 0
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+
+  def lookup(self, prompt, scope):
+    """The most similar cached entry in the scope (with its similarity) or None"""
+    text = normalize(prompt)
+    sig = signature(text)
+    nums = numbers(text)
+    now = time.time()
+    with self.lock:
+      candidates = set()
+      for key in band_keys(scope, sig):
+        candidates.update(self.buckets.get(key, ()))
+      best = None
+      best_similarity = 0
+      for id in candidates:
+        entry = self.entries[id]
+        if now - entry["time"] > self.ttl_seconds:
+          self.remove(id)
+          continue
+        if entry["numbers"] != nums:
+          continue
+        s = similarity(sig, entry["signature"])
+        if s >= self.threshold and s > best_similarity:
+          best = entry
+          best_similarity = s
+      if best is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self.entries.move_to_end(best["id"])
+      return dict(best, similarity=best_similarity)
+
+  def add(self, prompt, scope, verdict, answer):
+    text = normalize(prompt)
+    sig = signature(text)
+    with self.lock:
+      id = self.next_id
+      self.next_id += 1
+      self.entries[id] = { "id": id, "prompt": prompt, "scope": scope, "verdict": verdict, "answer": answer,
+                           "signature": sig, "numbers": numbers(text), "time": time.time() }
+      for key in band_keys(scope, sig):
+        self.buckets.setdefault(key, set()).add(id)
+      while len(self.entries) > self.max_entries:
+        self.remove(next(iter(self.entries)))
+
+  def remove(self, id):
+    entry = self.entries.pop(id)
+    for key in band_keys(entry["scope"], entry["signature"]):
+      bucket = self.buckets.get(key)
+      if bucket is not None:
+        bucket.discard(id)
+        if len(bucket) == 0:
+          del self.buckets[key]
+
+cache = None
+
+def configure(threshold, ttl_seconds, max_entries):
+  global cache
+  if cache is None:
+    cache = SemanticCache(threshold, ttl_seconds, max_entries)
+  else:
+    cache.threshold = threshold
+    cache.ttl_seconds = ttl_seconds
+    cache.max_entries = max_entries
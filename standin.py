@@ -0,0 +1,431 @@
+# A local stand-in for the model vendor APIs so the real support.ask path can be exercised (and load tested)
+# offline without API keys. Set config.standin_url to the server's URL to point every model at it.
+#
+# Speaks the request/response shapes used by the model modules:
+#   OpenAI and Grok chat completions   POST /v1/chat/completions
+#   Llama API chat completions         POST /chat/completions
+#   HuggingFace chat completions       POST /models/<model>/v1/chat/completions
+#   Anthropic messages                 POST /v1/messages
+#   Gemini generateContent             POST /v1beta/models/<model>:generateContent (and :streamGenerateContent)
+#   Gemini cached contents             POST /v1beta/cachedContents
+#   OpenAI Batch API                   POST /v1/files, POST /v1/batches, GET /v1/batches/<id>, GET /v1/files/<id>/content
+#   Anthropic Message Batches          POST /v1/messages/batches, GET /v1/messages/batches/<id> (and /results)
+# Requests with "stream": true get server sent events in the vendor's streaming format.
+# Prompt caching is simulated (OpenAI style automatic prefix caching, Anthropic cache control blocks and Gemini
+# cached contents) with the cached tokens reported in the usage and not counted in the prefill time.
+import sys
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+from aiohttp import web
+
+# Comparison queries are recognised by the instructions comparison.py adds to them
+comparison_markers = ["Compare their two", "Compare each pair"]
+batch_pair = re.compile(r"Pair (\d+): ")
+
+class Settings:
+  """How the stand-in behaves. Latencies are in seconds."""
+  latency = 0.5          # median latency of a response
+  latency_sigma = 0.3    # spread of the lognormal latency distribution (0 for a fixed latency)
+  error_rate = 0.0       # fraction of requests failing with a 500
+  rate_limit_rate = 0.0  # fraction of requests failing with a 429
+  retry_after = 1
+  verdicts = []          # scripted comparator answers e.g. ["YES", "NO"] used in turn
+  agree_rate = 1.0       # chance of a YES when no verdicts are scripted
+  answer = "The answer is 42."
+  answer_chars = 0       # pad answers to this many characters to simulate verbose models
+  stream_chunk_chars = 16
+  prefill_seconds_per_1k_tokens = 0.0 # extra latency per thousand uncached prompt tokens
+  cache_min_tokens = 1024             # shortest prefix cached
+  batch_seconds = 1.0                 # time a batch job takes to end
+  key_requests_per_minute = None      # rate limit per api key (with x-ratelimit-remaining-requests headers)
+
+def prompt_text(body):
+  """The prompt text of any of the supported request shapes"""
+  texts = []
+  for message in body.get("messages", []):
+    content = message.get("content", "")
+    if isinstance(content, list):
+      for block in content:
+        texts.append(block.get("text", ""))
+    else:
+      texts.append(content)
+  for part in body.get("systemInstruction", {}).get("parts", []):
+    texts.append(part.get("text", ""))
+  for content in body.get("contents", []):
+    for part in content.get("parts", []):
+      texts.append(part.get("text", ""))
+  system = body.get("system", "")
+  if isinstance(system, list):
+    for block in system:
+      texts.append(block.get("text", ""))
+  else:
+    texts.append(system)
+  return "\n".join(texts)
+
+def tokens(text):
+  return max(1, len(text) // 4)
+
+class StandIn:
+
+  def __init__(self, settings):
+    self.settings = settings
+    self.verdict_index = 0
+    self.requests = 0
+    self.cached_prefixes = set()
+    self.cached_contents = {} # name -> text
+    self.files = {}           # id -> content
+    self.batches = {}         # id -> batch (with the time it ends)
+    self.key_windows = {}     # api key -> (minute, requests in it)
+
+  def verdict(self):
+    s = self.settings
+    if len(s.verdicts) > 0:
+      verdict = s.verdicts[self.verdict_index % len(s.verdicts)]
+      self.verdict_index += 1
+    else:
+      verdict = "YES" if random.random() < s.agree_rate else "NO"
+    return verdict
+
+  def answer(self, prompt):
+    s = self.settings
+    if any(marker in prompt for marker in comparison_markers):
+      pairs = batch_pair.findall(prompt)
+      if len(pairs) > 0:
+        return json.dumps([{ "pair": int(p), "agree": self.verdict() == "YES" } for p in pairs])
+      return self.verdict()
+    text = s.answer
+    if len(text) < s.answer_chars:
+      text = (text + " ") * (s.answer_chars // (len(text) + 1)) + text
+    return text
+
+  async def delay(self, uncached_tokens=0):
+    s = self.settings
+    if s.latency_sigma > 0:
+      latency = random.lognormvariate(0, s.latency_sigma) * s.latency
+    else:
+      latency = s.latency
+    await asyncio.sleep(latency + uncached_tokens / 1000 * s.prefill_seconds_per_1k_tokens)
+
+  def cache(self, key):
+    """True if the key was cached before (caching it now if not)"""
+    if key in self.cached_prefixes:
+      return True
+    if len(self.cached_prefixes) > 100000:
+      self.cached_prefixes.clear()
+    self.cached_prefixes.add(key)
+    return False
+
+  def prompt_cache(self, body, prompt, automatic):
+    """The (read, written) prompt tokens of a request served from or added to the prompt cache"""
+    s = self.settings
+    system = body.get("system")
+    if isinstance(system, list): # Anthropic cache control blocks
+      marked = "".join(block.get("text", "") for block in system if "cache_control" in block)
+      if marked == "" or tokens(marked) < s.cache_min_tokens:
+        return 0, 0
+      return (tokens(marked), 0) if self.cache(("anthropic", marked)) else (0, tokens(marked))
+    if "cachedContent" in body: # Gemini
+      return tokens(self.cached_contents.get(body["cachedContent"], "")), 0
+    if automatic: # OpenAI style automatic caching of the longest prefix seen before in steps of 128 tokens
+      read = 0
+      for end in range(512, len(prompt) + 1, 512):
+        if self.cache(("prefix", prompt[:end])):
+          read = end
+      return (read // 4 if read // 4 >= s.cache_min_tokens else 0), 0
+    return 0, 0
+
+  def rate_limit_headers(self, request):
+    """The rate limit headers for the request's api key or None if the key has no requests left this minute"""
+    limit = self.settings.key_requests_per_minute
+    if limit is None:
+      return {}
+    auth = request.headers.get("Authorization", "")
+    key = request.headers.get("x-api-key") or request.query.get("key") or auth[len("Bearer "):]
+    minute = int(time.time() // 60)
+    window, count = self.key_windows.get(key, (minute, 0))
+    if window != minute:
+      count = 0
+    if count >= limit:
+      return None
+    self.key_windows[key] = (minute, count + 1)
+    return { "x-ratelimit-remaining-requests": str(limit - count - 1) }
+
+  async def handle(self, request, respond, stream, model=None, streaming=False, automatic_caching=False):
+    self.requests += 1
+    try:
+      body = await request.json()
+    except ValueError:
+      return web.json_response({"error": {"message": "invalid JSON body"}}, status=400)
+    headers = self.rate_limit_headers(request)
+    if headers is None:
+      return web.json_response({"error": {"message": "rate limit of the api key reached"}}, status=429,
+                               headers={"Retry-After": str(60 - int(time.time()) % 60)})
+    prompt = self.cached_contents.get(body.get("cachedContent"), "") + prompt_text(body)
+    cache = self.prompt_cache(body, prompt, automatic_caching)
+    await self.delay(tokens(prompt) - cache[0])
+    r = random.random()
+    if r < self.settings.rate_limit_rate:
+      return web.json_response({"error": {"message": "rate limited"}}, status=429,
+                               headers={"Retry-After": str(self.settings.retry_after)})
+    if r < self.settings.rate_limit_rate + self.settings.error_rate:
+      return web.json_response({"error": {"message": "internal error"}}, status=500)
+    text = self.answer(prompt)
+    model = body.get("model", model or request.match_info.get("model", "stand-in"))
+    if body.get("stream", False) or streaming:
+      return await self.send_stream(request, stream(model, text, prompt))
+    return web.json_response(respond(model, text, prompt, cache), headers=headers)
+
+  async def send_stream(self, request, events):
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    for event in events:
+      await response.write(event.encode())
+      await asyncio.sleep(0)
+    await response.write_eof()
+    return response
+
+  def chunks(self, text):
+    n = self.settings.stream_chunk_chars
+    return [text[i:i + n] for i in range(0, len(text), n)]
+
+  # OpenAI style (OpenAI, Grok, Llama API, HuggingFace)
+
+  def openai_response(self, model, text, prompt, cache=(0, 0)):
+    return {
+      "id": "chatcmpl-standin-" + str(self.requests),
+      "object": "chat.completion",
+      "created": int(time.time()),
+      "model": model,
+      "choices": [{ "index": 0, "message": { "role": "assistant", "content": text }, "finish_reason": "stop" }],
+      "usage": { "prompt_tokens": tokens(prompt), "completion_tokens": tokens(text),
+                 "total_tokens": tokens(prompt) + tokens(text), "prompt_tokens_details": { "cached_tokens": cache[0] } }
+    }
+
+  def openai_stream(self, model, text, prompt):
+    for chunk in self.chunks(text):
+      data = { "object": "chat.completion.chunk", "model": model,
+               "choices": [{ "index": 0, "delta": { "content": chunk }, "finish_reason": None }] }
+      yield "data: " + json.dumps(data) + "\n\n"
+    yield "data: [DONE]\n\n"
+
+  async def chat_completions(self, request):
+    return await self.handle(request, self.openai_response, self.openai_stream, automatic_caching=True)
+
+  # Anthropic messages
+
+  def anthropic_response(self, model, text, prompt, cache=(0, 0)):
+    return {
+      "id": "msg_standin_" + str(self.requests),
+      "type": "message",
+      "role": "assistant",
+      "model": model,
+      "content": [{ "type": "text", "text": text }],
+      "stop_reason": "end_turn",
+      "usage": { "input_tokens": tokens(prompt) - cache[0] - cache[1], "output_tokens": tokens(text),
+                 "cache_read_input_tokens": cache[0], "cache_creation_input_tokens": cache[1] }
+    }
+
+  def anthropic_stream(self, model, text, prompt):
+    start = { "type": "message_start", "message": { "model": model, "role": "assistant", "content": [],
+              "usage": { "input_tokens": tokens(prompt), "output_tokens": 0 } } }
+    yield "event: message_start\ndata: " + json.dumps(start) + "\n\n"
+    for chunk in self.chunks(text):
+      delta = { "type": "content_block_delta", "index": 0, "delta": { "type": "text_delta", "text": chunk } }
+      yield "event: content_block_delta\ndata: " + json.dumps(delta) + "\n\n"
+    yield "event: message_stop\ndata: {\"type\": \"message_stop\"}\n\n"
+
+  async def messages(self, request):
+    return await self.handle(request, self.anthropic_response, self.anthropic_stream)
+
+  # Gemini generateContent
+
+  def gemini_response(self, model, text, prompt, cache=(0, 0)):
+    response = {
+      "candidates": [{ "content": { "parts": [{ "text": text }], "role": "model" }, "finishReason": "STOP", "index": 0 }],
+      "usageMetadata": { "promptTokenCount": tokens(prompt), "candidatesTokenCount": tokens(text),
+                         "totalTokenCount": tokens(prompt) + tokens(text) },
+      "modelVersion": model
+    }
+    if cache[0] > 0:
+      response["usageMetadata"]["cachedContentTokenCount"] = cache[0]
+    return response
+
+  def gemini_stream(self, model, text, prompt):
+    for chunk in self.chunks(text):
+      yield "data: " + json.dumps(self.gemini_response(model, chunk, prompt)) + "\n\n"
+
+  async def generate_content(self, request):
+    model, _, method = request.match_info["call"].partition(":")
+    if method not in ["generateContent", "streamGenerateContent"]:
+      return web.json_response({"error": {"message": "unknown method " + method}}, status=404)
+    return await self.handle(request, self.gemini_response, self.gemini_stream, model,
+                             method == "streamGenerateContent")
+
+  async def create_cached_content(self, request):
+    body = await request.json()
+    name = "cachedContents/standin-" + str(len(self.cached_contents) + 1)
+    self.cached_contents[name] = prompt_text(body)
+    return web.json_response({ "name": name, "model": body.get("model"),
+                               "usageMetadata": { "totalTokenCount": tokens(self.cached_contents[name]) } })
+
+  # Batch APIs (answered when the batch is created and made available once it has ended)
+
+  def batch_response(self, respond, body):
+    prompt = prompt_text(body)
+    return respond(body.get("model", "stand-in"), self.answer(prompt), prompt)
+
+  async def upload_file(self, request):
+    reader = await request.multipart()
+    content = None
+    async for part in reader:
+      if part.name == "file":
+        content = (await part.read()).decode()
+    id = "file-standin-" + str(len(self.files) + 1)
+    self.files[id] = content or ""
+    return web.json_response({ "id": id, "object": "file", "purpose": "batch", "bytes": len(self.files[id]) })
+
+  async def file_content(self, request):
+    content = self.files.get(request.match_info["id"])
+    if content is None:
+      return web.json_response({"error": {"message": "no such file"}}, status=404)
+    return web.Response(text=content, content_type="application/jsonl")
+
+  async def create_openai_batch(self, request):
+    body = await request.json()
+    lines = []
+    for line in self.files.get(body.get("input_file_id"), "").splitlines():
+      if line.strip() == "":
+        continue
+      item = json.loads(line)
+      lines.append(json.dumps({ "id": "batch_req_" + item["custom_id"], "custom_id": item["custom_id"], "error": None,
+                                "response": { "status_code": 200, "body": self.batch_response(self.openai_response, item["body"]) } }))
+    id = "batch_standin_" + str(len(self.batches) + 1)
+    output_file_id = "file-standin-output-" + id
+    self.files[output_file_id] = "\n".join(lines) + "\n"
+    self.batches[id] = { "id": id, "object": "batch", "endpoint": body.get("endpoint"), "input_file_id": body.get("input_file_id"),
+                         "output_file_id": output_file_id, "error_file_id": None,
+                         "request_counts": { "total": len(lines), "completed": len(lines), "failed": 0 },
+                         "ends": time.time() + self.settings.batch_seconds }
+    return web.json_response(self.openai_batch(id))
+
+  def openai_batch(self, id):
+    batch = dict(self.batches[id])
+    ended = time.time() >= batch.pop("ends")
+    batch["status"] = "completed" if ended else "in_progress"
+    if not ended:
+      batch["output_file_id"] = None
+    return batch
+
+  async def get_openai_batch(self, request):
+    if request.match_info["id"] not in self.batches:
+      return web.json_response({"error": {"message": "no such batch"}}, status=404)
+    return web.json_response(self.openai_batch(request.match_info["id"]))
+
+  async def create_message_batch(self, request):
+    body = await request.json()
+    results = []
+    for item in body.get("requests", []):
+      message = self.batch_response(self.anthropic_response, item["params"])
+      results.append(json.dumps({ "custom_id": item["custom_id"], "result": { "type": "succeeded", "message": message } }))
+    id = "msgbatch_standin_" + str(len(self.batches) + 1)
+    self.batches[id] = { "id": id, "type": "message_batch", "results": "\n".join(results) + "\n",
+                         "request_counts": { "processing": 0, "succeeded": len(results), "errored": 0 },
+                         "results_url": str(request.url.origin()) + "/v1/messages/batches/" + id + "/results",
+                         "ends": time.time() + self.settings.batch_seconds }
+    return web.json_response(self.message_batch(id))
+
+  def message_batch(self, id):
+    batch = dict(self.batches[id])
+    del batch["results"]
+    ended = time.time() >= batch.pop("ends")
+    batch["processing_status"] = "ended" if ended else "in_progress"
+    if not ended:
+      batch["results_url"] = None
+    return batch
+
+  async def get_message_batch(self, request):
+    if request.match_info["id"] not in self.batches:
+      return web.json_response({"error": {"message": "no such batch"}}, status=404)
+    return web.json_response(self.message_batch(request.match_info["id"]))
+
+  async def message_batch_results(self, request):
+    batch = self.batches.get(request.match_info["id"])
+    if batch is None or time.time() < batch["ends"]:
+      return web.json_response({"error": {"message": "no results"}}, status=404)
+    return web.Response(text=batch["results"], content_type="application/jsonl")
+
+  def make_app(self):
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/v1/chat/completions", self.chat_completions)
+    app.router.add_post("/chat/completions", self.chat_completions)
+    app.router.add_post("/models/{model:.+}/v1/chat/completions", self.chat_completions)
+    app.router.add_post("/v1/messages", self.messages)
+    app.router.add_post("/v1beta/models/{call}", self.generate_content)
+    app.router.add_post("/v1beta/cachedContents", self.create_cached_content)
+    app.router.add_post("/v1/files", self.upload_file)
+    app.router.add_get("/v1/files/{id}/content", self.file_content)
+    app.router.add_post("/v1/batches", self.create_openai_batch)
+    app.router.add_get("/v1/batches/{id}", self.get_openai_batch)
+    app.router.add_post("/v1/messages/batches", self.create_message_batch)
+    app.router.add_get("/v1/messages/batches/{id}", self.get_message_batch)
+    app.router.add_get("/v1/messages/batches/{id}/results", self.message_batch_results)
+    return app
+
+async def start(settings, host="127.0.0.1", port=8089, unix=None):
+  """Start a stand-in server in the running event loop (on a Unix socket path if given).
+     Returns the runner to clean up when done."""
+  runner = web.AppRunner(StandIn(settings).make_app())
+  await runner.setup()
+  if unix is not None:
+    await web.UnixSite(runner, unix).start()
+  else:
+    await web.TCPSite(runner, host, port).start()
+  return runner
+
+def parse_settings(argv):
+  parser = argparse.ArgumentParser(description="Local stand-in for the model vendor APIs")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8089)
+  parser.add_argument("--unix", default=None, help="serve on this Unix socket path instead of host and port")
+  parser.add_argument("--latency", type=float, default=Settings.latency, help="median latency in seconds")
+  parser.add_argument("--latency-sigma", type=float, default=Settings.latency_sigma, help="lognormal spread, 0 for fixed")
+  parser.add_argument("--error-rate", type=float, default=Settings.error_rate)
+  parser.add_argument("--rate-limit-rate", type=float, default=Settings.rate_limit_rate)
+  parser.add_argument("--verdicts", default="", help="scripted comparator answers used in turn e.g. YES,YES,NO")
+  parser.add_argument("--agree-rate", type=float, default=Settings.agree_rate)
+  parser.add_argument("--answer", default=Settings.answer)
+  parser.add_argument("--answer-chars", type=int, default=Settings.answer_chars)
+  parser.add_argument("--prefill", type=float, default=Settings.prefill_seconds_per_1k_tokens,
+                      help="extra seconds per thousand uncached prompt tokens")
+  parser.add_argument("--cache-min-tokens", type=int, default=Settings.cache_min_tokens)
+  parser.add_argument("--batch-seconds", type=float, default=Settings.batch_seconds, help="time a batch job takes")
+  parser.add_argument("--key-rpm", type=int, default=Settings.key_requests_per_minute, help="requests per minute per api key")
+  args = parser.parse_args(argv)
+
+  settings = Settings()
+  settings.latency = args.latency
+  settings.latency_sigma = args.latency_sigma
+  settings.error_rate = args.error_rate
+  settings.rate_limit_rate = args.rate_limit_rate
+  settings.verdicts = [v.strip().upper() for v in args.verdicts.split(",") if v.strip() != ""]
+  settings.agree_rate = args.agree_rate
+  settings.answer = args.answer
+  settings.answer_chars = args.answer_chars
+  settings.prefill_seconds_per_1k_tokens = args.prefill
+  settings.cache_min_tokens = args.cache_min_tokens
+  settings.batch_seconds = args.batch_seconds
+  settings.key_requests_per_minute = args.key_rpm
+  return settings, args.host, args.port, args.unix
+
+if __name__ == "__main__":
+  settings, host, port, unix = parse_settings(sys.argv[1:])
+  if unix is not None:
+    print(f"Stand-in model server on {unix} (set config.local_unix_socket to use it for the local model)")
+    web.run_app(StandIn(settings).make_app(), path=unix, print=None)
+  else:
+    print(f"Stand-in model server on http://{host}:{port} (set config.standin_url to use it)")
+    web.run_app(StandIn(settings).make_app(), host=host, port=port, print=None)
@@ -1,10 +1,21 @@
+import re
+import time
+import asyncio
+import contextvars
+import transport
 import json
 
 class Model:
     """Base class for all AI models"""
     def make_query(text): raise RuntimeError("Not implemented")
+    def make_verdict_query(text): raise RuntimeError("Not implemented") # short, deterministic YES/NO answer
     async def ask(session, query): raise RuntimeError("Not implemented")
     # fields to implement: name, model, text_field
+    host = None # scheme and host of the API (for connection warm up)
+    # make_cached_query(prefix, text, verdict) for APIs where a static prompt prefix has to be marked to be cached.
+    # None if the API caches prefixes automatically (or not at all) so the prefix is just sent first.
+    make_cached_query = None
+    batch_api = None # the vendor batch API (see batchapi.py) the model's queries can be sent through
     pass
 
 def serialize(json_object):
@@ -26,6 +37,29 @@ def make_openai_std_query_from_obj(text, model):
 
 make_openai_std_query = make_openai_std_query_from_obj
 
+# Output budget for a comparison verdict (YES or NO)
+verdict_max_tokens = 5
+
+def make_openai_verdict_query(text, model):
+  obj = { "model": model, "max_tokens": verdict_max_tokens, "temperature": 0, "stop": ["\n", "."] }
+  message = { "role": "user" }
+  message["content"] = text
+  obj["messages"] = [message]
+
+  return serialize(obj)
+
+verdict_word = re.compile(r"\b(YES|NO)\b")
+
+def parse_verdict(text):
+  """True for a YES verdict, False for NO and None if there is no verdict in the text"""
+  words = re.findall(r"[A-Za-z]+", text)
+  if len(words) > 0 and words[0].upper() in ["YES", "NO"]:
+    return words[0].upper() == "YES"
+  match = verdict_word.search(text)
+  if match is None:
+    return None
+  return match.group(1) == "YES"
+
 def read_file_as_string(filepath):
     try:
         with open(filepath, 'r') as file:
@@ -38,15 +72,102 @@ def read_file_as_string(filepath):
         print(f"An error occurred while reading '{filepath}': {e}")
         return None
     
+# Base URL (e.g. "http://127.0.0.1:8089" for the standin.py server) to send all model requests to
+# instead of the vendor hosts. None to use the real APIs.
+url_override = None
+
+def set_url_override(base_url):
+  global url_override
+  url_override = base_url
+
+def rewrite_url(url):
+  """Replace the scheme and host of a model url with the override url if one is set"""
+  if url_override is None:
+    return url
+  path_start = url.find("/", url.find("://") + 3)
+  path = url[path_start:] if path_start != -1 else "/"
+  return url_override.rstrip("/") + path
+
+# Largest response body to read (responses are read incrementally and dropped once they go over)
+max_response_bytes = 4 * 1024 * 1024
+# A different limit for the model being asked in the current task (see multillm.ask_model)
+response_byte_limit = contextvars.ContextVar("response_byte_limit", default=None)
+
+def set_max_response_bytes(limit):
+  global max_response_bytes
+  max_response_bytes = limit
+
+def too_large(limit):
+  return "{\"error\": \"response too large\", \"limit\": " + str(limit) + "}"
+
+# The transport.py transport to post queries with (HTTP/1.1 aiohttp by default or HTTP/2 httpx)
+http_transport = transport.AiohttpTransport()
+# Gzip request bodies of at least this many bytes (None to not compress, not all APIs accept it)
+gzip_request_min_bytes = None
+
+def set_transport(t, gzip_min_bytes):
+  global http_transport, gzip_request_min_bytes
+  http_transport = t
+  gzip_request_min_bytes = gzip_min_bytes
+
+# Transport statistics of the current call (see multillm.ask_model)
+call_stats = contextvars.ContextVar("call_stats", default=None)
+
+# A cassette.Cassette to record requests and responses to or replay them from. None to just make the requests.
+cassette = None
+
+def set_cassette(c):
+  global cassette
+  if cassette is not None and cassette is not c and cassette.recording():
+    cassette.close()
+  cassette = c
+
 async def ask(url, session, query, headers):
+  url = rewrite_url(url)
+  if cassette is not None and cassette.replaying():
+    entry = cassette.replay(url, query)
+    if entry is None:
+      print(f"Not in cassette {url}")
+      return "{\"error\": \"not in cassette\"}"
+    await asyncio.sleep(cassette.delay(entry))
+    print(f"Replayed {url}: Status code {entry['status']}")
+    return entry["body"]
+
+  start = time.time()
+  status, text = await post(url, session, query, headers)
+  if cassette is not None and cassette.recording():
+    cassette.record(url, query, status, time.time() - start, text)
+  return text
+
+async def post(url, session, query, headers):
+  """Post a query returning the status (None if there was no response) and response text"""
+  limit = response_byte_limit.get() or max_response_bytes
+  stats = call_stats.get()
+  if stats is None:
+    stats = {}
+  body, headers = transport.compress(query.encode(), headers, gzip_request_min_bytes)
+  stats["bytes_sent"] = len(body)
   try:
-    async with session.post(url, data=query.encode(), headers=headers) as response:
-      print(f"Fetched {url}: Status code {response.status}")
-      if response.status != 200:
-        return "{\"error\": " + str(response.status) + "}"
-      return await response.text()
+    status, text = await http_transport.post(session, url, body, headers, limit, stats)
+    stats["status"] = status
+    print(f"Fetched {url}: Status code {status}")
+    if status != 200:
+      return status, "{\"error\": " + str(status) + "}"
+    if text is None:
+      return status, too_large(limit)
+    return status, text
   except Exception as e:
-    return "{ \"error\": \"" + e.__class__.__name__ + "\"}"
+    return None, "{ \"error\": \"" + e.__class__.__name__ + "\"}"
+
+def is_error(response):
+  """True if a model response is empty, not JSON or an error object"""
+  if response is None or response.strip() == "":
+    return True
+  try:
+    json_data = json.loads(response)
+  except ValueError:
+    return True
+  return isinstance(json_data, dict) and "error" in json_data
 
 def search_json(json_data, target_key):
     """Recursively searches a JSON object for a key."""
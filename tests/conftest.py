@@ -0,0 +1,93 @@
+import os
+import sys
+import atexit
+import shutil
+import socket
+import asyncio
+import tempfile
+import threading
+import pytest
+
+# The modules are imported from the repository root. config.py needs api key files in the working directory
+# (any key will do as every model is pointed at the stand-in server).
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+work_dir = tempfile.mkdtemp(prefix="multillm-tests-")
+atexit.register(shutil.rmtree, work_dir, True)
+os.chdir(work_dir)
+for name in ["gemini", "claud", "openai", "grok", "llama", "hugface"]:
+  with open(name + "-api-key", "w") as file:
+    file.write("test-key\n")
+
+import standin
+import config
+import support
+import multillm
+import gemini
+
+def free_port():
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    return s.getsockname()[1]
+
+class StandIn:
+  """A stand-in server (standin.py) running in-process on its own event loop and thread"""
+
+  def __init__(self, unix=None):
+    self.settings = standin.Settings()
+    self.settings.latency = 0.01
+    self.settings.latency_sigma = 0
+    self.settings.batch_seconds = 0.1
+    self.port = free_port()
+    self.url = "http://127.0.0.1:" + str(self.port)
+    self.loop = asyncio.new_event_loop()
+    self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+    self.thread.start()
+    self.runner = self.call(standin.start(self.settings, port=self.port, unix=unix))
+
+  def call(self, coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+  def stop(self):
+    self.call(self.runner.cleanup())
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    self.thread.join()
+    self.loop.close()
+
+@pytest.fixture(autouse=True)
+def reconfigure():
+  """Push the configuration (restored by monkeypatch after the test) down to the modules again"""
+  yield
+  config.configure()
+
+@pytest.fixture
+def server(monkeypatch):
+  """A stand-in server every model request is sent to"""
+  s = StandIn()
+  monkeypatch.setattr(config, "standin_url", s.url)
+  monkeypatch.setattr(gemini, "cached_contents", {}) # (names made by other servers)
+  config.configure()
+  yield s
+  s.stop()
+
+@pytest.fixture
+def sent(monkeypatch):
+  """The (url, query) of every model request made"""
+  requests = []
+  ask = support.ask
+
+  async def recording_ask(url, session, query, headers):
+    requests.append((url, query))
+    return await ask(url, session, query, headers)
+
+  monkeypatch.setattr(support, "ask", recording_ask)
+  return requests
+
+def run_comparison(prompt, action):
+  """Run a comparison on a new event loop returning the trail and usage"""
+  async def run():
+    try:
+      return await multillm.run_comparison_with_usage(prompt, action)
+    finally:
+      await multillm.close_connections()
+  return asyncio.run(run())
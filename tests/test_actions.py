@@ -0,0 +1,133 @@
+import json
+import pytest
+
+import standin
+import config
+import multillm
+import comparison
+import support
+from conftest import StandIn, run_comparison
+
+prompt = "What is 6 times 7?"
+answer = standin.Settings.answer
+
+# action -> comparator calls made when every comparison agrees (3 models scheduled)
+actions = {
+  "1-way": 1,
+  "2-way": 1,
+  "3-way": 1,
+  "2-1": 1,
+  "3-all": 3,
+  "n-way": 3,
+  "quorum-2": 1,
+  "quorum-3": 3
+}
+
+def schedule(monkeypatch, names):
+  for name in config.schedule:
+    monkeypatch.setitem(config.schedule, name, name in names)
+
+@pytest.mark.parametrize("action", actions.keys())
+def test_action_passes_when_comparators_agree(server, action):
+  trail, usage = run_comparison(prompt, action)
+  assert trail[-2] == "PASS compared response"
+  assert trail[-1] == answer
+  assert usage["comparison"]["calls"] == actions[action]
+  assert usage["query"]["calls"] == (2 if action in ["1-way", "2-1", "quorum-2"] else 3)
+
+@pytest.mark.parametrize("action", actions.keys())
+def test_action_fails_when_comparators_disagree(server, action):
+  server.settings.verdicts = ["NO"]
+  trail, usage = run_comparison(prompt, action)
+  assert trail[-2] == "FAIL comparison"
+
+def test_3_way_goes_on_to_the_next_pair(server):
+  server.settings.verdicts = ["NO", "YES"]
+  trail, usage = run_comparison(prompt, "3-way")
+  assert trail[-2] == "PASS compared response"
+  assert usage["comparison"]["calls"] == 2
+
+def test_2_1_queries_a_third_model_when_the_first_two_disagree(server):
+  server.settings.verdicts = ["NO", "YES"]
+  trail, usage = run_comparison(prompt, "2-1")
+  assert trail[-2] == "PASS compared response"
+  assert usage["query"]["calls"] == 3
+  assert usage["comparison"]["calls"] == 2
+
+def test_quorum_brings_in_models_until_k_agree(server, monkeypatch):
+  schedule(monkeypatch, ["gemini", "openai", "claud", "grok", "llama"])
+  server.settings.verdicts = ["NO", "YES", "YES"]
+  trail, usage = run_comparison(prompt, "quorum-2")
+  assert trail[-2] == "PASS compared response"
+  assert usage["query"]["calls"] == 3 # the third model agrees with the first
+
+def test_batched_comparisons_send_one_request_per_comparator(server, sent, monkeypatch):
+  schedule(monkeypatch, ["gemini", "openai", "claud", "grok", "llama"])
+  monkeypatch.setattr(multillm, "batch_comparisons", True)
+  trail, usage = run_comparison(prompt, "n-way")
+  assert trail[-2] == "PASS compared response"
+  # the 10 pairs go to the 3 comparators (each differing from the models compared): 6 to openai, 3 to gemini
+  # in a request each and gemini and openai's pair to claud on its own
+  assert usage["comparison"]["calls"] == 3
+  assert len([query for url, query in sent if "Compare each pair" in query]) == 2
+
+def test_batched_comparisons_take_the_verdict_list(server, monkeypatch):
+  schedule(monkeypatch, ["gemini", "openai", "claud", "grok", "llama"])
+  monkeypatch.setattr(multillm, "batch_comparisons", True)
+  server.settings.verdicts = ["NO"]
+  trail, usage = run_comparison(prompt, "n-way")
+  assert trail[-2] == "FAIL comparison"
+  assert usage["comparison"]["calls"] == 3
+
+def test_verdict_mode_asks_for_just_yes_or_no(server, sent, monkeypatch):
+  monkeypatch.setattr(config, "verdict_mode", True)
+  monkeypatch.setattr(multillm, "verdict_mode", True)
+  config.configure()
+  trail, usage = run_comparison(prompt, "3-all")
+  assert trail[-2] == "PASS compared response"
+  comparisons = [(url, json.loads(query)) for url, query in sent if "Compare their two" in query]
+  assert len(comparisons) == 3
+  for url, query in comparisons:
+    assert comparison.verdict_instructions.replace("\n", "\\n") in json.dumps(query)
+    if "generateContent" in url:
+      assert query["generationConfig"]["maxOutputTokens"] == support.verdict_max_tokens
+    else:
+      assert query["max_tokens"] == support.verdict_max_tokens
+
+def test_cacheable_layout_marks_the_prefix_for_claud_and_gemini(server, sent, monkeypatch):
+  monkeypatch.setattr(config, "prompt_caching", True)
+  monkeypatch.setattr(config, "gemini_cache_min_tokens", 1)
+  config.configure()
+  server.settings.cache_min_tokens = 1
+  run_comparison(prompt, "3-all")
+  trail, usage = run_comparison(prompt, "3-all")
+  assert trail[-2] == "PASS compared response"
+
+  claud = [json.loads(query) for url, query in sent if url.endswith("/v1/messages") and "system" in query]
+  assert len(claud) == 2
+  assert claud[0]["system"][0]["cache_control"] == { "type": "ephemeral" }
+  assert comparison.cache_break not in json.dumps(claud[0])
+  assert answer not in claud[0]["system"][0]["text"] # the prefix has no answers in it
+
+  made = [url for url, query in sent if "cachedContents" in url]
+  assert len(made) == 1 # made once and used for both runs
+  gemini = [json.loads(query) for url, query in sent if "generateContent" in url and "cachedContent" in query]
+  assert len(gemini) == 2
+  assert "systemInstruction" not in gemini[0]
+
+  # the second run reads the prefix of its Claud and Gemini comparisons from the cache
+  assert usage["comparison"]["cached_tokens"] > 0
+
+def test_local_model_over_a_unix_socket(server, monkeypatch, tmp_path):
+  local = StandIn(unix=str(tmp_path / "llm.sock"))
+  local.settings.answer = "Local says 42."
+  try:
+    monkeypatch.setattr(config, "local_unix_socket", str(tmp_path / "llm.sock"))
+    config.configure()
+    schedule(monkeypatch, ["local", "gemini", "openai"])
+    trail, usage = run_comparison(prompt, "3-way")
+    assert trail[-2] == "PASS compared response"
+    assert "Local says 42." in trail
+    assert usage["query"]["calls"] == 3
+  finally:
+    local.stop()
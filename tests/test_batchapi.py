@@ -0,0 +1,73 @@
+import json
+import asyncio
+import aiohttp
+import pytest
+
+import standin
+import config
+import multillm
+import batchapi
+
+prompts = ["What is 6 times 7?", "What is the capital of France?"]
+
+@pytest.fixture
+def rounds(server, monkeypatch):
+  """The pending queries of each batch round run"""
+  made = []
+  run_round = batchapi.run_round
+
+  async def counting_run_round(pending):
+    made.append(dict(pending))
+    return await run_round(pending)
+
+  monkeypatch.setattr(batchapi, "run_round", counting_run_round)
+  monkeypatch.setattr(config, "batch_poll_seconds", 0.05)
+  return made
+
+def test_3_way_runs_in_an_answer_and_a_comparison_round(server, rounds):
+  results = asyncio.run(batchapi.run_batch(prompts, "3-way"))
+  results = json.loads(json.dumps(results)) # as written to the results file
+  assert len(rounds) == 2
+  # gemini is asked directly, claud and openai through their batch APIs
+  assert sorted(model.name for model in rounds[0].values()) == ["claud", "claud", "gemini", "gemini", "openai", "openai"]
+  assert [model.name for model in rounds[1].values()] == ["openai", "openai"] # comparing gemini and claud
+  for prompt, result in zip(prompts, results):
+    assert result["prompt"] == prompt
+    assert result["action"] == "3-way"
+    assert result["compared_response"] == standin.Settings.answer
+    assert result["trail"][-2] == "PASS compared response"
+    assert result["usage"]["query"]["calls"] == 3
+    assert result["usage"]["comparison"]["calls"] == 1
+
+def test_finished_results_are_kept_when_rounds_run_out(server, rounds, monkeypatch):
+  monkeypatch.setattr(config, "batch_max_rounds", 2)
+  server.settings.verdicts = ["YES", "NO"] # the second prompt needs a third round to compare the next pair
+  results = asyncio.run(batchapi.run_batch(prompts, "3-way"))
+  assert len(rounds) == 2
+  assert results[0]["compared_response"] == standin.Settings.answer
+  assert "compared_response" not in results[1]
+  assert results[1]["prompt"] == prompts[1]
+  assert results[1]["error"] == "run not done after 2 rounds"
+
+def test_a_failed_round_keeps_the_runs_already_done(server, rounds, monkeypatch):
+  server.settings.verdicts = ["YES", "NO"] # the second prompt goes on to compare gemini and openai using claud
+  run_anthropic_batch = batchapi.batch_apis["anthropic"]
+
+  async def failing_anthropic_batch(session, queries):
+    if len(rounds) == 3:
+      raise RuntimeError("batch rejected")
+    return await run_anthropic_batch(session, queries)
+
+  monkeypatch.setitem(batchapi.batch_apis, "anthropic", failing_anthropic_batch)
+  results = asyncio.run(batchapi.run_batch(prompts, "3-way"))
+  assert len(rounds) == 3
+  assert results[0]["compared_response"] == standin.Settings.answer
+  assert results[1]["error"] == "batch round 3 failed: RuntimeError: batch rejected"
+
+def test_direct_calls_time_out(server, rounds, monkeypatch):
+  monkeypatch.setattr(multillm, "timeout", aiohttp.ClientTimeout(total=0.05))
+  server.settings.latency = 0.5 # the batch jobs aren't delayed, only the models asked directly
+  results = asyncio.run(batchapi.run_batch(prompts[:1], "3-way"))
+  trail = results[0]["trail"]
+  assert trail[trail.index("model gemini") + 1] == "No response text found!"
+  assert trail[-2] == "FAIL comparison"
@@ -0,0 +1,108 @@
+import gzip
+import time
+import asyncio
+import weakref
+
+# HTTP transports used by support.ask to post model queries.
+# Each returns the status, the response text (None if larger than limit bytes, empty if the status isn't 200)
+# and fills in transport statistics: bytes sent and received, time to the response headers and HTTP version.
+
+accept_encoding = "gzip, deflate"
+
+def compress(body, headers, gzip_min_bytes):
+  """Gzip a request body of at least gzip_min_bytes (None to never compress)"""
+  if gzip_min_bytes is None or len(body) < gzip_min_bytes:
+    return body, headers
+  headers = dict(headers)
+  headers["Content-Encoding"] = "gzip"
+  return gzip.compress(body), headers
+
+def rate_limit_stats(headers, stats):
+  """The requests left in the rate limit window and the Retry-After seconds of a response (see keypool.py)"""
+  remaining = headers.get("x-ratelimit-remaining-requests") or headers.get("anthropic-ratelimit-requests-remaining")
+  if remaining is not None and remaining.isdigit():
+    stats["ratelimit_remaining"] = int(remaining)
+  retry_after = headers.get("Retry-After")
+  if retry_after is not None and retry_after.isdigit():
+    stats["retry_after"] = int(retry_after)
+
+class AiohttpTransport:
+  """HTTP/1.1 using the aiohttp session the models are asked with"""
+  name = "aiohttp"
+
+  async def post(self, session, url, body, headers, limit, stats):
+    start = time.time()
+    headers = dict(headers)
+    headers.setdefault("Accept-Encoding", accept_encoding)
+    async with session.post(url, data=body, headers=headers) as response:
+      stats["headers_ms"] = round((time.time() - start) * 1000, 1)
+      stats["http_version"] = f"HTTP/{response.version.major}.{response.version.minor}"
+      stats["content_encoding"] = response.headers.get("Content-Encoding")
+      rate_limit_stats(response.headers, stats)
+      if response.status != 200:
+        return response.status, ""
+      if response.content_length is not None and response.content_length > limit:
+        return response.status, None
+      data = bytearray()
+      async for chunk in response.content.iter_chunked(64 * 1024):
+        if len(data) + len(chunk) > limit:
+          return response.status, None
+        data += chunk
+      # the wire size if known otherwise the (decompressed) body size
+      stats["bytes_received"] = response.content_length if response.content_length is not None else len(data)
+      return response.status, data.decode(response.charset or "utf-8", errors="replace")
+
+  async def close(self):
+    pass
+
+class HttpxTransport:
+  """HTTP/2 with one multiplexed connection per host (needs pip install 'httpx[http2]').
+     The aiohttp session is not used."""
+  name = "httpx"
+
+  def __init__(self, timeout_seconds=30):
+    try:
+      import httpx
+      import h2 # the HTTP/2 extra, checked here so a missing one fails at configure time and not on the first call
+    except ImportError:
+      raise RuntimeError("The httpx transport needs httpx with HTTP/2 support: pip install 'httpx[http2]'")
+    self.httpx = httpx
+    self.timeout_seconds = timeout_seconds
+    self.clients = weakref.WeakKeyDictionary() # event loop -> client
+
+  def client(self):
+    loop = asyncio.get_running_loop()
+    client = self.clients.get(loop)
+    if client is None or client.is_closed:
+      client = self.httpx.AsyncClient(http2=True, timeout=self.timeout_seconds)
+      self.clients[loop] = client
+    return client
+
+  async def post(self, session, url, body, headers, limit, stats):
+    start = time.time()
+    headers = dict(headers)
+    headers.setdefault("Accept-Encoding", accept_encoding)
+    async with self.client().stream("POST", url, content=body, headers=headers) as response:
+      stats["headers_ms"] = round((time.time() - start) * 1000, 1)
+      stats["http_version"] = response.http_version
+      stats["content_encoding"] = response.headers.get("Content-Encoding")
+      rate_limit_stats(response.headers, stats)
+      if response.status_code != 200:
+        return response.status_code, ""
+      data = bytearray()
+      async for chunk in response.aiter_bytes():
+        if len(data) + len(chunk) > limit:
+          return response.status_code, None
+        data += chunk
+      stats["bytes_received"] = response.num_bytes_downloaded
+      return response.status_code, data.decode(response.encoding or "utf-8", errors="replace")
+
+  async def close(self):
+    client = self.clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+      await client.aclose()
+
+def make_transport(name, timeout_seconds):
+  if name == "httpx":
+    return HttpxTransport(timeout_seconds)
+  return AiohttpTransport()
@@ -0,0 +1,116 @@
+import os
+import sys
+import asyncio
+import multiprocessing
+
+from config import configure, restore, snapshot, set_trail_only
+from config import job_queue_file, job_visibility_timeout_seconds, job_max_attempts
+from jobqueue import JobQueue
+import multillm
+
+poll_seconds = 0.5
+
+def get_queue():
+  return JobQueue(job_queue_file, job_visibility_timeout_seconds, job_max_attempts)
+
+async def keep_lease(queue, job, worker):
+  """Extend the lease on a job while it runs so it isn't delivered to another worker"""
+  while True:
+    await asyncio.sleep(job_visibility_timeout_seconds / 3)
+    if not queue.extend(job["id"], worker):
+      print(f"{worker} lost the lease on job {job['id']}")
+      return
+
+async def work(worker):
+  queue = get_queue()
+  while True:
+    job = queue.claim(worker)
+    if job is None:
+      await asyncio.sleep(poll_seconds)
+      continue
+
+    print(f"{worker} running job {job['id']} ({job['action']}, attempt {job['attempts']})")
+    lease = asyncio.create_task(keep_lease(queue, job, worker))
+    try:
+      restore(job["config"])
+      trail, usage = await multillm.run_comparison_with_usage(job["prompt"], job["action"])
+      queue.complete(job["id"], worker, { "compared_response": trail[-1], "trail": trail, "usage": usage })
+    except Exception as e:
+      print(f"{worker} failed job {job['id']}: {e}")
+      queue.fail(job["id"], worker, f"{e.__class__.__name__}: {e}")
+    finally:
+      lease.cancel()
+
+def run_worker(i):
+  set_trail_only(True)
+  configure()
+  worker = f"worker-{os.getpid()}-{i}"
+  try:
+    asyncio.run(work(worker))
+  except KeyboardInterrupt:
+    pass
+
+def read_prompts(file):
+  """Prompts separated by blank lines (as in the prompts file)"""
+  prompts = []
+  for prompt in file.read().split("\n\n"):
+    if prompt.strip() != "":
+      prompts.append(multillm.clean(prompt.strip()))
+  return prompts
+
+def main():
+  if len(sys.argv) > 2 and sys.argv[1] == "run":
+    processes = []
+    for i in range(int(sys.argv[2])):
+      process = multiprocessing.Process(target=run_worker, args=(i,))
+      process.start()
+      processes.append(process)
+    try:
+      for process in processes:
+        process.join()
+    except KeyboardInterrupt:
+      for process in processes:
+        process.join()
+
+  elif len(sys.argv) > 2 and sys.argv[1] == "enqueue":
+    configure()
+    queue = get_queue()
+    if len(sys.argv) > 3:
+      with open(sys.argv[3], "r") as file:
+        prompts = read_prompts(file)
+    else:
+      prompts = read_prompts(sys.stdin)
+    for prompt in prompts:
+      print(queue.enqueue(prompt, sys.argv[2], snapshot()))
+
+  elif len(sys.argv) > 1 and sys.argv[1] == "status":
+    print(get_queue().counts())
+
+  elif len(sys.argv) > 2 and sys.argv[1] == "result":
+    job = get_queue().get(sys.argv[2])
+    if job is None:
+      print("no such job")
+    elif job["state"] == "done":
+      print(job["result"]["compared_response"])
+      if job["result"].get("usage") is not None:
+        print(f"cost ${job['result']['usage']['total']['cost']:.6f}")
+    else:
+      print(job["state"] + ("" if job["error"] is None else " " + job["error"]))
+
+  else:
+    print(
+"""Usage: python3 worker.py run N
+          -- start N worker processes taking jobs from the job queue (config job_queue_file)
+
+          python3 worker.py enqueue 3-way|2-way|1-way|none|2-1|3-all|n-way|quorum-k [prompts-file]
+          -- queue a job for each prompt (separated by blank lines) in the file or read from input
+
+          python3 worker.py status
+          -- show the number of jobs in each state
+
+          python3 worker.py result job-id
+          -- show the compared response of a job (or its state)
+          """)
+
+if __name__ == "__main__":
+  main()